@@ -1,54 +1,107 @@
 import streamlit as st
-from newspaper import Article
-import openai
-import time
-import tiktoken
-import requests
-from datetime import datetime
-import librosa
-import soundfile as sf
-import numpy as np
 import os
 import uuid
-import json
+from article_cache import ArticleCache, cached_summary, fetch_article, normalize_url
+from cost_ledger import COMPLETION_PRICES, SPEECH_PRICES, CostLedger
+from history_store import HistoryStore
+from http_client import StaleWhileRevalidate, create_client
+from checkpoint import CheckpointStore, LayeredCache, job_id_for_url
+from metrics import METRICS, METRICS_JSONL_FILE, METRICS_PROM_FILE
+from progressive import SegmentPlaylist
+from progress import StageClock, estimate_stage_seconds, format_remaining, load_stage_timings
+from pipeline import build_script_prompt, render_episode, stream_script
+from script_text import iter_dialogues, split_script_by_speaker
+from episode_store import EPISODE_MAX_AGE_DAYS, EPISODE_MAX_BYTES, EpisodeStore
+import summarizer
+from segment_cache import SEGMENT_CACHE_MAX_BYTES, SegmentCache
+from tts import TTS_MAX_INPUT_CHARS, TTS_MODEL, write_episode
 
 # secretsからAPIキーを取得
 OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
-# 履歴ファイルのパス
-HISTORY_FILE = "audio_history.json"
+@st.cache_resource
+def get_openai_client():
+    """全セッションで共有する OpenAI のクライアント
+
+    openai の読み込みと接続プールの作成は、最初に API を使うときに1回だけ行う
+    （スクリプトが再実行されるたびにクライアントを作り直さない）。
+    """
+    import openai
+    return openai.OpenAI(api_key=OPENAI_API_KEY)
+
+# TTSの同時実行数（secretsで変更可能）
+TTS_MAX_WORKERS = int(st.secrets.get("TTS_MAX_WORKERS", 4))
+
+# 同じ話者の連続したセリフをまとめる1リクエストの最大文字数（0 ならまとめない、secretsで変更可能）
+TTS_MAX_REQUEST_CHARS = int(st.secrets.get("TTS_MAX_REQUEST_CHARS", TTS_MAX_INPUT_CHARS))
+
+# 音声キャッシュの容量の上限（バイト、secretsで変更可能）
+TTS_CACHE_MAX_BYTES = int(st.secrets.get("TTS_CACHE_MAX_BYTES", SEGMENT_CACHE_MAX_BYTES))
+
+# 結合するときの正規化方法（"peak" または "loudness"、secretsで変更可能）
+# "loudness" ではセリフの音量を揃えるため、MP3をデコードして結合し直す（時間がかかる）
+AUDIO_NORMALIZE_MODE = st.secrets.get("AUDIO_NORMALIZE_MODE", "peak")
+
+# 計測結果の出力先（JSONL と Prometheus のテキスト形式、空にすると出力しない、secretsで変更可能）
+METRICS_JSONL_PATH = st.secrets.get("METRICS_JSONL_FILE", METRICS_JSONL_FILE)
+METRICS_PROM_PATH = st.secrets.get("METRICS_PROM_FILE", METRICS_PROM_FILE)
+
+@st.cache_resource
+def get_segment_cache():
+    """全セッションで共有する音声キャッシュ"""
+    return SegmentCache(max_bytes=TTS_CACHE_MAX_BYTES)
+
+# エピソードの保存容量（バイト）と保存日数の上限（secretsで変更可能）
+EPISODE_STORE_MAX_BYTES = int(st.secrets.get("EPISODE_MAX_BYTES", EPISODE_MAX_BYTES))
+EPISODE_STORE_MAX_AGE_DAYS = st.secrets.get("EPISODE_MAX_AGE_DAYS", EPISODE_MAX_AGE_DAYS)
+
+@st.cache_resource
+def get_episode_store():
+    """全セッションで共有するエピソードの保存先"""
+    return EpisodeStore(max_bytes=EPISODE_STORE_MAX_BYTES, max_age_days=EPISODE_STORE_MAX_AGE_DAYS)
+
+# 履歴を一度に表示する件数
+HISTORY_PAGE_SIZE = 10
+
+# 為替レートのAPI（ベンチマークではローカルのスタブを指定する）と、取得できなかったときのレート
+EXCHANGE_RATE_URL = st.secrets.get("EXCHANGE_RATE_URL", "https://api.exchangerate-api.com/v4/latest/USD")
+EXCHANGE_RATE_TIMEOUT = 3.0
+DEFAULT_EXCHANGE_RATE = 145.0
+
+# コストの内訳に表示する段階の名前
+STAGE_LABELS = {"summary": "要約", "script": "台本", "tts": "音声生成"}
 
 # アプリケーションのバージョン
 APP_VERSION = "1.1.0"
 
-def load_history():
-    """履歴をファイルから読み込む"""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+@st.cache_resource
+def get_history_store():
+    """全セッションで共有する生成履歴（以前の audio_history.json は最初に取り込む）"""
+    return HistoryStore()
 
-def save_history(history):
-    """履歴をファイルに保存する"""
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+@st.cache_resource
+def get_http_client():
+    """全セッションで共有するHTTPクライアント（接続プール・タイムアウト付き）"""
+    return create_client()
 
-@st.cache_data(ttl=3600)  # 1時間キャッシュ
-def get_exchange_rate() -> float:
-    """USD/JPYの為替レートを取得"""
-    try:
-        response = requests.get("https://api.exchangerate-api.com/v4/latest/USD")
-        data = response.json()
-        return data["rates"]["JPY"]
-    except Exception as e:
-        st.warning("為替レートの取得に失敗しました。固定レート(145円)を使用します。")
-        return 145.0
+def fetch_exchange_rate() -> float:
+    """USD/JPYの為替レートをAPIから取得"""
+    response = get_http_client().get(EXCHANGE_RATE_URL, timeout=EXCHANGE_RATE_TIMEOUT)
+    response.raise_for_status()
+    return float(response.json()["rates"]["JPY"])
+
+@st.cache_resource
+def get_exchange_rate_cache():
+    """為替レートを1時間キャッシュし、古くなったらバックグラウンドで更新する"""
+    return StaleWhileRevalidate(fetch_exchange_rate, max_age=3600)
 
-def count_tokens(text: str) -> int:
-    """テキストのトークン数を計算"""
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    return len(encoding.encode(text))
+def get_exchange_rate() -> float:
+    """USD/JPYの為替レートを取得（更新を待たずにキャッシュした値を返す）"""
+    rate = get_exchange_rate_cache().get()
+    if rate is None:
+        st.warning(f"為替レートの取得に失敗しました。固定レート({DEFAULT_EXCHANGE_RATE:.0f}円)を使用します。")
+        return DEFAULT_EXCHANGE_RATE
+    return rate
 
 def format_cost_jpy(usd_cost: float) -> str:
     """USDのコストを日本円に変換"""
@@ -56,228 +109,158 @@ def format_cost_jpy(usd_cost: float) -> str:
     jpy_cost = usd_cost * rate
     return f"¥{jpy_cost:,.0f}"
 
-def format_cost_usd(tokens: int) -> float:
-    """トークン数から概算コストを計算（USD）"""
-    # GPT-4の料金: $0.03/1K tokens (input), $0.06/1K tokens (output)
-    return (tokens * 0.03) / 1000
+@st.cache_resource
+def get_cost_ledger():
+    """全セッションで共有する料金の記録"""
+    return CostLedger()
+
+@st.cache_resource
+def get_checkpoint_store():
+    """全セッションで共有するジョブの途中結果の保存先"""
+    store = CheckpointStore()
+    store.prune()
+    return store
+
+@st.cache_resource
+def get_article_cache():
+    """全セッションで共有する記事と要約のキャッシュ"""
+    return ArticleCache()
 
 def get_article_text(url):
-    """記事を取得する"""
-    article = Article(url, language='ja')
-    article.download()
-    article.parse()
-    return {
-        'text': article.text,
-        'title': article.title,
-        'images': article.images
-    }
+    """記事を取得する（取得済みの記事は条件付きGETで更新を確認する）"""
+    return fetch_article(url, get_article_cache(), client=get_http_client())
 
-def summarize_article(article_info):
-    """記事を要約する"""
-    # 記事の本文と画像情報を組み合わせる
-    article_content = f"記事タイトル: {article_info['title']}\n\n"
-    
-    # 画像の説明を追加
-    if article_info['images']:
-        article_content += "記事内の画像:\n"
-        for i, img_url in enumerate(article_info['images'], 1):
-            article_content += f"画像{i}: {img_url}\n"
-        article_content += "\n"
-    
-    article_content += f"記事本文:\n{article_info['text']}"
-    
-    prompt = (
-        "以下の記事（本文と画像を含む）の内容を、重要なポイントを逃さないように要約してください。\n"
-        "特に画像については、その意図や伝えたいメッセージを分析して要約してください。\n\n"
-        "【記事内容】\n"
-        f"{article_content}\n\n"
-        "【要約】"
-    )
-    
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7,
+def summarize_article(article_info, usage=None):
+    """記事を要約する（長い記事は分割して並列に要約してからまとめる）
+
+    内容が同じ記事の要約がキャッシュにあれば、GPT-4を呼ばずに再利用する。
+    usage にリストを渡すと、GPT-4のリクエストごとのトークン数を追加する。
+    戻り値は (要約, キャッシュから取得したかどうか)。
+    """
+    return cached_summary(
+        article_info, get_article_cache(),
+        lambda info: summarizer.summarize_article(get_openai_client(), info, usage=usage),
+        summarizer.SUMMARY_MODEL
     )
-    
-    return response.choices[0].message.content.strip()
 
-def combine_audio_files(teacher_file, student_file, output_file="output_combined.mp3"):
-    """音声ファイルを結合する"""
+def combine_audio_files(teacher_file, student_file, output_file=None):
+    """音声ファイルを結合する
+
+    output_file を省略すると、エピソードの保存先に内容のハッシュ名で保存する。
+    """
+    store = get_episode_store()
+    temp_file = store.temp_path()
     try:
         # 音声ファイルを読み込む
-        teacher_audio, sr = librosa.load(teacher_file, sr=None)
-        student_audio, _ = librosa.load(student_file, sr=sr)
-        
-        # 0.5秒の無音を作成
-        silence = np.zeros(int(0.5 * sr))
-        
-        # 音声を結合（正規化してから結合）
-        teacher_audio = librosa.util.normalize(teacher_audio)
-        student_audio = librosa.util.normalize(student_audio)
-        combined = np.concatenate([teacher_audio, silence, student_audio])
+        with open(teacher_file, "rb") as f:
+            teacher_audio = f.read()
+        with open(student_file, "rb") as f:
+            student_audio = f.read()
         
-        # 結合した音声を保存（正規化してから保存）
-        combined = librosa.util.normalize(combined)
-        sf.write(output_file, combined, sr)
+        # 0.5秒の無音を挟んで結合（形式が揃っていればデコードせずに結合）
+        write_episode([teacher_audio, student_audio], temp_file, normalize_mode=AUDIO_NORMALIZE_MODE)
         
-        return output_file
+        if output_file:
+            os.replace(temp_file, output_file)
+            return output_file
+        return store.commit(temp_file)
     except Exception as e:
+        store.discard(temp_file)
         st.error(f"音声の結合中にエラーが発生しました: {str(e)}")
         return None
 
-def split_script_by_speaker(script):
-    """台本をA（先生）とB（生徒）のパートに分割"""
-    lines = script.split('\n')
-    dialogues = []
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith('A:'):
-            dialogues.append({
-                'speaker': 'teacher',
-                'text': line.replace('A:', '').strip()
-            })
-        elif line.startswith('B:'):
-            dialogues.append({
-                'speaker': 'student',
-                'text': line.replace('B:', '').strip()
-            })
-    
-    return dialogues
-
-def convert_to_ssml(text):
-    """テキストを音声生成用に変換する"""
-    # テキストを文単位に分割
-    sentences = []
-    current_sentence = ""
-    
-    for char in text:
-        current_sentence += char
-        if char in ["。", "？", "！"]:
-            sentences.append(current_sentence.strip())
-            current_sentence = ""
-    
-    if current_sentence:
-        sentences.append(current_sentence.strip())
-    
-    # 各文に間を設定
-    processed_sentences = []
-    for sentence in sentences:
-        # 文節の区切りを処理
-        parts = []
-        current_part = ""
-        in_quote = False
-        
-        for char in sentence:
-            if char == "「":
-                if current_part:
-                    parts.append(current_part)
-                current_part = "「"
-                in_quote = True
-            elif char == "」" and in_quote:
-                current_part += "」"
-                parts.append(current_part)
-                current_part = ""
-                in_quote = False
-            else:
-                current_part += char
-        
-        if current_part:
-            parts.append(current_part)
-        
-        # 各部分に適切な間を設定
-        processed_parts = []
-        for i, part in enumerate(parts):
-            if part.startswith("「"):
-                processed_parts.append(f"、{part}")
-            elif part.endswith("」"):
-                processed_parts.append(f"{part}、")
-            else:
-                # 句読点の処理
-                part = part.replace("、", "、")
-                processed_parts.append(part)
-        
-        processed_sentence = "".join(processed_parts)
-        processed_sentences.append(processed_sentence)
-    
-    # 文を結合
-    processed_text = "。".join(processed_sentences) + "。"
-    
-    return processed_text
+def generate_tts(script, on_progress=None, cache_stats=None, checkpoint=None, playlist=None, on_billed=None):
+    """音声を生成して結合する
 
-def generate_tts(script):
-    """音声を生成して結合する"""
+    on_progress を渡すと、セリフの音声が1つ完成するたびに (完了数, 総数) で呼び出す。
+    cache_stats に辞書を渡すと、音声キャッシュのヒット数・ミス数と節約額を記録する。
+    checkpoint（JobCheckpoint）を渡すと、セリフの音声をジョブの途中結果として保存し、
+    前回の実行で保存した音声を再利用する。
+    on_billed を渡すと、APIで音声を生成したリクエストが終わるたびにその文字数で呼び出す。
+    """
     # 台本をセリフごとに分割
     dialogues = split_script_by_speaker(script)
+    return synthesize_dialogues(dialogues, on_progress, cache_stats, checkpoint, playlist, on_billed)
+
+def synthesize_dialogues(dialogues, on_progress=None, cache_stats=None, checkpoint=None, playlist=None,
+                         on_billed=None):
+    """セリフのリストまたはイテレータから音声を生成して結合する
+
+    イテレータを渡すと、セリフが届くたびにすぐ音声化を始める。
+    on_progress には (完了数, それまでに届いたセリフ数) が渡される。
+    playlist（SegmentPlaylist）を渡すと、完成した部分から順に再生できるようにする。
+    """
+    cache = get_segment_cache()
+    if checkpoint:
+        cache = LayeredCache(checkpoint, cache)
+    voices = {
+        'teacher': st.session_state.teacher_voice,
+        'student': st.session_state.student_voice
+    }
     
-    # 各セリフの音声を生成して結合
-    combined_audio = None
-    sr = None
+    # ストリーミング中の台本の生成で起きたエラーは、音声のエラーとして扱わずにそのまま伝える
+    script_errors = []
     
-    for i, dialogue in enumerate(dialogues):
-        # テキストを音声生成用に変換
-        processed_text = convert_to_ssml(dialogue['text'])
-        
+    def guarded(dialogues):
         try:
-            # 音声を生成（文字列型であることを確認）
-            voice = str(st.session_state.teacher_voice if dialogue['speaker'] == 'teacher' else st.session_state.student_voice)
-            st.write(f"Using voice: {voice} for {dialogue['speaker']}")  # デバッグ用
-            
-            response = client.audio.speech.create(
-                model="tts-1",
-                voice=voice,
-                input=processed_text,
-                response_format="mp3"
-            )
-            
-            # 一時ファイルとして保存
-            temp_file = f"temp_{dialogue['speaker']}_{i}.mp3"
-            with open(temp_file, "wb") as f:
-                f.write(response.content)
-            
-            # 音声を読み込む
-            audio, current_sr = librosa.load(temp_file, sr=None)
-            if sr is None:
-                sr = current_sr
-            
-            # 音声を正規化
-            audio = librosa.util.normalize(audio)
-            
-            # 音声を結合
-            if combined_audio is None:
-                combined_audio = audio
-            else:
-                # 0.5秒の無音を追加
-                silence = np.zeros(int(0.5 * sr))
-                combined_audio = np.concatenate([combined_audio, silence, audio])
-            
-            # 一時ファイルを削除
-            os.remove(temp_file)
-            
+            yield from dialogues
         except Exception as e:
-            st.error(f"音声生成中にエラーが発生しました: {str(e)}")
-            st.error(f"Voice value: {voice}, Type: {type(voice)}")  # デバッグ用
-            return None, 0
+            script_errors.append(e)
+            raise
     
-    if combined_audio is None:
-        st.error("音声の生成に失敗しました。")
+    try:
+        output_file, tts_cost_usd, errors = render_episode(
+            get_openai_client(), guarded(dialogues), voices, get_episode_store(), cache=cache,
+            max_workers=TTS_MAX_WORKERS, normalize_mode=AUDIO_NORMALIZE_MODE,
+            on_progress=on_progress, cache_stats=cache_stats, max_request_chars=TTS_MAX_REQUEST_CHARS,
+            on_audio=playlist.add if playlist else None, on_billed=on_billed
+        )
+        if playlist:
+            playlist.finish()
+    except Exception as e:
+        if script_errors:
+            raise
+        st.error(f"音声の読み込み中にエラーが発生しました: {str(e)}")
         return None, 0
     
-    # 結合した音声を保存
-    output_file = "output_combined.mp3"
-    combined_audio = librosa.util.normalize(combined_audio)
-    sf.write(output_file, combined_audio, sr)
+    for i, e in sorted(errors.items()):
+        st.warning(f"セリフ{i + 1}の音声生成に失敗したためスキップしました: {str(e)}")
     
-    # 音声生成のコストを計算（$0.015/1K characters）
-    total_chars = sum(len(d['text']) for d in dialogues)
-    tts_cost_usd = (total_chars * 0.015) / 1000
+    if output_file is None:
+        st.error("音声の生成に失敗しました。")
+        return None, 0
+    
+    # 保存期間・容量の上限を超えたエピソードを削除（履歴にあるものは後回し）
+    # （削除に失敗しても、生成したエピソードはそのまま返す）
+    try:
+        get_episode_store().evict(keep=get_history_store().files() + [output_file])
+    except OSError:
+        pass
     
     return output_file, tts_cost_usd
 
-def generate_script(article_info):
-    total_cost_usd = 0
-    cost_details = []
+def generate_script(article_info, streaming=True, checkpoint=None, url=None, progressive=False):
+    """記事から台本と音声を生成する
+
+    streaming が True のときは、台本をストリーミングで受け取りながら、
+    完成したセリフから順に音声化する（台本の生成と音声の生成が並行して進む）。
+    checkpoint（JobCheckpoint）を渡すと、要約・台本・セリフの音声を途中結果として
+    保存し、前回失敗したジョブは最初の未完了の段階から再開する。
+    APIの料金はリクエストごとに料金の記録（CostLedger）に追記し、
+    再開したジョブは前回の実行の分も合わせて表示する。
+    progressive が True のときは、先頭から揃ったセリフの音声をパートごとに
+    表示して、エピソード全体の完成を待たずに再生できるようにする。
+    戻り値は (音声ファイルのパス, 合計のコスト, すべてのセリフの音声ができたか)。
+    音声ができなければパスは None。
+    """
+    notes = []
+    ledger = get_cost_ledger()
+    run = checkpoint.load("run") if checkpoint else None
+    if run is None:
+        run = str(uuid.uuid4())
+        if checkpoint:
+            checkpoint.save("run", run)
+    entry = {'article': url, 'title': article_info['title']}
     
     # 進捗表示用のコンテナを作成
     progress_container = st.container()
@@ -288,115 +271,193 @@ def generate_script(article_info):
         time_text = st.empty()
         countdown_text = st.empty()
     
-    # カウントダウン用の関数
-    def update_countdown(remaining_seconds):
-        minutes = remaining_seconds // 60
-        seconds = remaining_seconds % 60
-        countdown_text.markdown(f"**残り時間: {minutes}分{seconds}秒**")
+    # 過去の実測時間から各ステージの所要時間を見積もる
+    timings = load_stage_timings()
+    article_chars = len(article_info['text'])
+    estimates = {
+        "summary": estimate_stage_seconds("summary", article_chars, timings),
+        "script": estimate_stage_seconds("script", article_chars, timings),
+        "tts": estimate_stage_seconds("tts", None, timings),
+    }
+    stage_order = list(estimates)
+    
+    # 進捗表示を実際の処理の進み具合で更新する関数
+    def update_progress(clock, done=None, detail=None):
+        index = stage_order.index(clock.stage)
+        estimates[clock.stage] = max(clock.elapsed() + clock.remaining(done), 1.0)
+        finished = sum(estimates[s] for s in stage_order[:index])
+        current = clock.fraction(done) * estimates[clock.stage]
+        total = sum(estimates.values())
+        remaining = clock.remaining(done) + sum(estimates[s] for s in stage_order[index + 1:])
+        progress_bar.progress(min(int((finished + current) / total * 100), 99))
+        countdown_text.markdown(
+            f"**残り時間: 約{format_remaining(remaining)}**" + (f"（{detail}）" if detail else "")
+        )
     
     # ステップ1: 記事の要約
     with progress_container:
         status_text.markdown("**ステップ1: 記事を要約中...**")
-        time_text.markdown("予定時間: 約30秒")
-        progress_bar.progress(20)
-        
-        # 30秒のカウントダウン
-        for i in range(30, 0, -1):
-            update_countdown(i)
-            time.sleep(1)
+        time_text.markdown(f"予定時間: 約{format_remaining(estimates['summary'])}")
+    summary_clock = StageClock("summary", article_chars, timings)
+    update_progress(summary_clock)
     
-    summary = summarize_article(article_info)
+    summary = checkpoint.load("summary") if checkpoint else None
+    if summary is None:
+        summary_usage = []
+        try:
+            summary, summary_cached = summarize_article(article_info, usage=summary_usage)
+        finally:
+            # 要約が途中で失敗しても、それまでに済んだリクエストの料金は記録する
+            ledger.record_completions(run, "summary", summary_usage, **entry)
+        # キャッシュから取得したときの時間は見積もりの学習に使わない
+        if summary_cached:
+            notes.append("要約: キャッシュを再利用")
+        else:
+            summary_clock.finish()
+        if checkpoint:
+            checkpoint.save("summary", summary)
+    else:
+        notes.append("要約: 前回の途中結果を再利用")
+    estimates["summary"] = summary_clock.elapsed()
     
     # ステップ2: 台本の生成
     with progress_container:
         status_text.markdown("**ステップ2: 台本を生成中...**")
-        time_text.markdown("予定時間: 約1分")
-        progress_bar.progress(50)
+        time_text.markdown(f"予定時間: 約{format_remaining(estimates['script'])}")
+    script_clock = StageClock("script", article_chars, timings)
+    update_progress(script_clock)
+    
+    # 前回の実行で台本までできていれば、台本の生成を省略して音声化から再開する
+    saved_script = checkpoint.load("script") if checkpoint else None
+    script_usage = []
+    if saved_script is not None:
+        streaming = False
+        stream = [saved_script]
+        notes.append("台本: 前回の途中結果を再利用")
+    else:
+        prompt = build_script_prompt(article_info, summary)
         
-        # 60秒のカウントダウン
-        for i in range(60, 0, -1):
-            update_countdown(i)
-            time.sleep(1)
-    
-    prompt = (
-        "以下の要約された記事内容を基に、テーマや結論がしっかり伝わるように、"
-        "聞き手が理解しやすい長さ（最大20分、ベストな長さはお任せします）で、"
-        "日本語のポッドキャスト台本にしてください。\n\n"
-        "【台本の形式】\n"
-        "- プロフェッショナルなホストA（先生役）と、初学者のホストB（生徒役）による対話形式\n"
-        "- 各発言の前に「A:」「B:」をつけて、誰の発言かを明確にする\n"
-        "- 会話の間は「...」ではなく「、」や「。」を使って自然な間を表現\n"
-        "- 最後に記事の重要なポイントをまとめて締めくくってください\n"
-        "- BGMや効果音などの演出指示は含めない\n\n"
-        "【台本の内容について】\n"
-        "- 専門用語が出てきたら、必ず身近な例を使って説明してください\n"
-        "- 「なぜそうなるのか」という理由や背景を丁寧に説明してください\n"
-        "- 抽象的な概念は具体的な例を使って説明してください\n"
-        "- 重要なポイントは繰り返し説明してください\n"
-        "- 生徒役（B）は適度に質問や疑問を投げかけ、理解を深めるようにしてください\n"
-        "- 先生役（A）は生徒の理解度を確認しながら、必要に応じて補足説明をしてください\n\n"
-        "【日本語の表現について】\n"
-        "- 自然な日本語のイントネーションになるように、適切な句読点を使用してください\n"
-        "- 重要な部分は強調するように、文の構造を工夫してください\n"
-        "- 会話の流れを考慮して、適切な間を取るようにしてください\n"
-        "- 文末表現は「です・ます」調を基本とし、必要に応じて「だ・である」調も使用してください\n\n"
-        "【画像の扱いについて】\n"
-        "- 画像の内容を単に説明するのではなく、その意図や伝えたいメッセージを会話の中で自然に伝えてください\n"
-        "- 例えば、象とりんごの大きさを比較する画像がある場合、\n"
-        "  ×「象とりんごの画像があります」\n"
-        "  ○「りんごは象と比較すると何倍も小さいです」\n"
-        "  のように、画像の意図を会話の中で自然に説明してください\n"
-        "- 画像の視覚的な要素（色、形、配置など）が重要な場合は、その効果や意図を説明してください\n"
-        "- 複数の画像がある場合は、それらの関連性やストーリー性を活かして説明してください\n\n"
-        "【記事タイトル】\n"
-        f"{article_info['title']}\n\n"
-        "【要約された内容】\n"
-        f"{summary}\n\n"
-        "【ポッドキャスト台本】"
-    )
-    
-    # トークン数を計算
-    input_tokens = count_tokens(prompt)
-    input_cost_usd = format_cost_usd(input_tokens)
-    total_cost_usd += input_cost_usd
-    cost_details.append(f"GPT-4入力: {input_tokens}トークン (${input_cost_usd:.4f})")
-    
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=4000,
-        temperature=0.8
-    )
-    
-    generated_text = response.choices[0].message.content
-    
-    # 出力トークン数からコストを計算
-    output_tokens = count_tokens(generated_text)
-    output_cost_usd = format_cost_usd(output_tokens)
-    total_cost_usd += output_cost_usd
-    cost_details.append(f"GPT-4出力: {output_tokens}トークン (${output_cost_usd:.4f})")
-    
-    # ステップ3: 音声の生成
-    with progress_container:
-        status_text.markdown("**ステップ3: 音声を生成中...**")
-        time_text.markdown("予定時間: 約2分")
-        progress_bar.progress(80)
+        # 台本をストリーミングで受け取り、届いたトークン数で進捗を更新する
+        # （トークン数は受信が終わった時点で script_usage に入る）
+        stream = stream_script(get_openai_client(), prompt, usage=script_usage)
+    
+    # 完成した部分から再生するためのパートの表示先
+    playlist = None
+    if progressive:
+        st.markdown("### 🔊 できた部分から再生")
+        parts_container = st.container()
+        playlist = SegmentPlaylist(
+            lambda part, data: parts_container.audio(data, format="audio/mp3")
+        )
+    
+    chunks = []
+    tts_state = {"clock": None, "offset": 0, "done": 0, "total": 0}
+    cache_stats = {}
+    
+    def start_tts_stage(segment_count, done=0):
+        # ステップ3: 音声の生成（残りのセリフ数に応じて見積もり直す）
+        units = max(segment_count - done, 1)
+        estimates["tts"] = estimate_stage_seconds("tts", units, timings)
+        with progress_container:
+            status_text.markdown("**ステップ3: 音声を生成中...**")
+            time_text.markdown(f"予定時間: 約{format_remaining(estimates['tts'])}")
+        tts_state["clock"] = StageClock("tts", units, timings)
+        tts_state["offset"] = done
+        update_progress(tts_state["clock"], done=0)
+    
+    def script_chunks():
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                if len(chunks) % 20 == 0:
+                    detail = f"{len(chunks)}トークン受信"
+                    if streaming:
+                        detail += f"・セリフ {tts_state['done']}/{tts_state['total']} 音声化済み"
+                    update_progress(script_clock, detail=detail)
+                yield chunk
+        finally:
+            # 受信が途中で失敗・中断しても、それまでに生成された台本の料金は記録する
+            if saved_script is None:
+                stream.close()
+                ledger.record_completions(run, "script", script_usage, **entry)
         
-        # 120秒のカウントダウン
-        for i in range(120, 0, -1):
-            update_countdown(i)
-            time.sleep(1)
-    
-    combined_file, tts_cost_usd = generate_tts(generated_text.strip())
-    total_cost_usd += tts_cost_usd
-    cost_details.append(f"TTS: ${tts_cost_usd:.4f}")
-    
-    # 完了
+        # 台本の受信が完了
+        if saved_script is None:
+            script_clock.finish()
+            if checkpoint:
+                checkpoint.save("script", "".join(chunks))
+        estimates["script"] = script_clock.elapsed()
+        if streaming:
+            start_tts_stage(len(split_script_by_speaker("".join(chunks))), tts_state["done"])
+    
+    def record_tts(chars):
+        # 音声生成の料金をAPIのリクエストが終わるたびに記録（キャッシュから取得した分は含めない）
+        ledger.record_speech(run, "tts", TTS_MODEL, [chars], **entry)
+    
+    def on_tts_progress(done, total):
+        tts_state["done"], tts_state["total"] = done, total
+        clock = tts_state["clock"]
+        if clock:
+            update_progress(clock, done=done - tts_state["offset"], detail=f"セリフ {done}/{total}")
+    
+    if streaming:
+        # 完成したセリフから順に音声化する
+        combined_file, tts_cost_usd = synthesize_dialogues(
+            iter_dialogues(script_chunks()), on_progress=on_tts_progress, cache_stats=cache_stats,
+            checkpoint=checkpoint, playlist=playlist, on_billed=record_tts
+        )
+        generated_text = "".join(chunks)
+    else:
+        generated_text = "".join(script_chunks())
+        start_tts_stage(len(split_script_by_speaker(generated_text)))
+        combined_file, tts_cost_usd = generate_tts(
+            generated_text.strip(), on_progress=on_tts_progress, cache_stats=cache_stats,
+            checkpoint=checkpoint, playlist=playlist, on_billed=record_tts
+        )
+    
+    if combined_file:
+        # キャッシュや途中結果から取得したセリフの分を除いて、APIで生成した分の時間として記録する
+        billed = cache_stats.get('misses', 0)
+        requested = billed + cache_stats.get('hits', 0)
+        if billed:
+            tts_state["clock"].finish(units=tts_state["clock"].units * billed / requested)
+        # すべてのセリフができたら途中結果は不要。失敗したセリフがあれば、
+        # 再実行で台本と生成済みのセリフを再利用できるように残しておく
+        if checkpoint and not cache_stats.get('failed'):
+            checkpoint.clear()
+    elif checkpoint and not (cache_stats.get('hits') or cache_stats.get('misses')):
+        # セリフを読み取れない台本などで音声が1つもできなければ、台本を残さずに作り直す
+        checkpoint.discard("script")
+    
+    if cache_stats.get('failed'):
+        notes.append(
+            f"{cache_stats['failed']}件の音声生成に失敗しました。もう一度実行すると、"
+            "台本と生成済みのセリフを再利用して失敗した部分だけを生成し直します"
+        )
+    if cache_stats.get('hits') or cache_stats.get('misses'):
+        notes.append(
+            f"音声キャッシュ: ヒット{cache_stats['hits']}件 / ミス{cache_stats['misses']}件 "
+            f"(節約 ${cache_stats.get('saved_usd', 0):.4f})"
+        )
+    
+    if not combined_file:
+        # 音声ができなかったので完了の表示はしない（エラーは synthesize_dialogues が表示済み）
+        with progress_container:
+            status_text.markdown("**❌ 音声を生成できませんでした**")
+            time_text.empty()
+            countdown_text.empty()
+        return None, ledger.run_total(run), False
+    
+    # 完了（音声生成に失敗したセリフがあれば、欠けた部分があることを表示する）
+    complete = not cache_stats.get('failed')
     with progress_container:
-        status_text.markdown("**✅ 処理が完了しました！**")
+        if complete:
+            status_text.markdown("**✅ 処理が完了しました！**")
+            progress_bar.progress(100)
+        else:
+            status_text.markdown("**⚠️ 一部のセリフが欠けた音声ができました**")
         time_text.empty()
         countdown_text.empty()
-        progress_bar.progress(100)
     
     # 結果表示
     st.markdown("### 📝 生成された台本")
@@ -405,13 +466,22 @@ def generate_script(article_info):
     st.markdown("### 🔊 生成された音声")
     st.audio(combined_file)
     
-    # コストの詳細を表示
+    # コストの詳細を料金の記録から表示
     st.markdown("### 💰 コストの内訳")
-    for detail in cost_details:
-        st.write(detail)
+    for stage, model, requests_count, prompt_tokens, completion_tokens, chars, cost in ledger.run_breakdown(run):
+        if stage == "tts":
+            st.write(f"{STAGE_LABELS[stage]}（{model}）: {chars}文字 / {requests_count}回 (${cost:.4f})")
+        else:
+            st.write(
+                f"{STAGE_LABELS[stage]}（{model}）: 入力{prompt_tokens}・出力{completion_tokens}トークン"
+                f" / {requests_count}回 (${cost:.4f})"
+            )
+    for note in notes:
+        st.write(note)
+    total_cost_usd = ledger.run_total(run)
     st.write(f"**合計: ${total_cost_usd:.4f} (約¥{total_cost_usd * get_exchange_rate():.0f})**")
     
-    return combined_file, total_cost_usd
+    return combined_file, total_cost_usd, complete
 
 # 音声の種類を定義
 VOICE_OPTIONS = {
@@ -427,15 +497,19 @@ VOICE_OPTIONS = {
     }
 }
 
-# 音声履歴を初期化
-if 'audio_history' not in st.session_state:
-    st.session_state.audio_history = load_history()
+# 履歴の表示件数を初期化
+if 'history_limit' not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
 
 # 音声の初期値を設定
 if 'teacher_voice' not in st.session_state:
     st.session_state.teacher_voice = "alloy"
 if 'student_voice' not in st.session_state:
     st.session_state.student_voice = "nova"
+if 'streaming_mode' not in st.session_state:
+    st.session_state.streaming_mode = True
+if 'progressive_mode' not in st.session_state:
+    st.session_state.progressive_mode = True
 
 # バージョン情報を表示
 st.markdown("""
@@ -467,51 +541,80 @@ with st.sidebar:
         key="student_voice"
     )
     
+    # 台本と音声の並行生成
+    st.checkbox(
+        "台本の生成と音声化を並行して行う（ストリーミング）",
+        key="streaming_mode",
+        help="台本の完成を待たずに、できあがったセリフから順に音声化します。"
+    )
+    
+    # 完成した部分からの再生
+    st.checkbox(
+        "できた部分から再生する",
+        key="progressive_mode",
+        help="音声全体の完成を待たずに、冒頭から順にできあがった部分を再生できるようにします。"
+    )
+    
     st.markdown("---")
     
-    # 料金目安の表示
-    st.markdown("### 💰 料金目安")
+    # これまでの料金の表示（料金の記録から集計）
+    st.markdown("### 💰 料金")
     rate = get_exchange_rate()
     st.markdown(f"**現在の為替レート: $1 = ¥{rate:.2f}**")
     
-    st.markdown("""
-    #### 1記事あたりの目安料金
-    - **短い記事（約1000文字）**: ¥50〜¥100
-    - **中程度の記事（約3000文字）**: ¥100〜¥200
-    - **長い記事（約5000文字）**: ¥200〜¥300
-    
-    #### 内訳
-    - **GPT-4入力**: ¥4.35/1K tokens
-    - **GPT-4出力**: ¥8.70/1K tokens
-    - **音声生成**: ¥2.18/1K文字
-    
-    #### 注意事項
-    - 料金は記事の長さや内容によって変動します
-    - 画像が多い記事は処理に時間がかかり、料金が高くなる可能性があります
-    - 音声の長さによっても料金が変動します
-    """)
+    ledger = get_cost_ledger()
+    daily = ledger.daily_totals(days=7)
+    if daily:
+        st.markdown("#### 直近7日間")
+        for day, cost, runs in daily:
+            st.markdown(f"- **{day}**: ¥{cost * rate:,.0f}（{runs}回）")
+    
+    by_article = ledger.article_totals(limit=5)
+    if by_article:
+        st.markdown("#### 料金の高い記事")
+        for article, title, cost, runs in by_article:
+            st.markdown(f"- {title or article}: ¥{cost * rate:,.0f}（{runs}回）")
+    
+    st.markdown("#### 単価")
+    for model, (input_price, output_price) in COMPLETION_PRICES.items():
+        st.markdown(f"- **{model}**: 入力 ¥{input_price * rate:.2f} / 出力 ¥{output_price * rate:.2f}（1Kトークン）")
+    st.markdown(f"- **{TTS_MODEL}**: ¥{SPEECH_PRICES[TTS_MODEL] * rate:.2f}（1K文字）")
     st.markdown("---")
     
-    # 履歴リストの表示
-    if st.session_state.audio_history:
+    # 履歴リストの表示（新しい順に表示件数の分だけ読み込む）
+    history = get_history_store()
+    history_count = history.count()
+    if history_count:
         st.markdown("### 📚 生成履歴")
-        for item in reversed(st.session_state.audio_history):
+        for item in history.page(st.session_state.history_limit):
             with st.expander(f"{item['title']} - {item['timestamp']}"):
-                st.audio(item['file'])
-                with open(item['file'], "rb") as f:
-                    st.download_button(
-                        "音声をダウンロード",
-                        f,
-                        file_name=f"podcast_{item['timestamp']}.mp3",
-                        mime="audio/mp3",
-                        key=f"dl_{item['id']}"
-                    )
+                if not os.path.exists(item['file']):
+                    st.warning("保存期間を過ぎたため、音声ファイルは削除されました。")
+                elif st.toggle("再生・ダウンロード", key=f"open_{item['id']}"):
+                    # 音声ファイルは開いた履歴の分だけ読み込む
+                    st.audio(item['file'])
+                    with open(item['file'], "rb") as f:
+                        st.download_button(
+                            "音声をダウンロード",
+                            f,
+                            file_name=f"podcast_{item['timestamp']}.mp3",
+                            mime="audio/mp3",
+                            key=f"dl_{item['id']}"
+                        )
                 
                 # 履歴から削除するボタン
                 if st.button("この履歴を削除", key=f"delete_{item['id']}"):
-                    st.session_state.audio_history = [h for h in st.session_state.audio_history if h['id'] != item['id']]
-                    save_history(st.session_state.audio_history)
+                    history.delete(item['id'])
+                    
+                    # 同じ音声を参照する履歴が残っていなければファイルも削除
+                    if not history.references(item['file']):
+                        get_episode_store().discard(item['file'])
                     st.rerun()
+        
+        if history_count > st.session_state.history_limit:
+            if st.button(f"さらに表示（残り{history_count - st.session_state.history_limit}件）"):
+                st.session_state.history_limit += HISTORY_PAGE_SIZE
+                st.rerun()
 
 url = st.text_input("記事のURLを入力してください")
 
@@ -519,32 +622,48 @@ if st.button("台本生成＆音声化"):
     if not url:
         st.error("URLを入力してください。")
     else:
+        checkpoint = None
         try:
-            article_info = get_article_text(url)
-            script, text_cost_usd = generate_script(article_info)
-            
-            # 音声を再生
-            st.audio(script)
-            
-            # 音声ファイルのダウンロードボタン
-            with open(script, "rb") as f:
-                st.download_button("音声をダウンロード", f, file_name="podcast.mp3", mime="audio/mp3")
-            
-            # 音声履歴に追加
-            history_item = {
-                'id': str(uuid.uuid4()),
-                'title': article_info['title'],
-                'file': script,
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            st.session_state.audio_history.append(history_item)
-            
-            # 履歴をファイルに保存
-            save_history(st.session_state.audio_history)
+            # 同じ記事の前回の途中結果があれば、未完了の段階から再開する
+            # （同じ記事を別のセッションが生成中なら、このセッションだけの途中結果を使う）
+            checkpoint = get_checkpoint_store().job(job_id_for_url(url))
+            article_info = checkpoint.load("article")
+            if article_info is None:
+                article_info = checkpoint.save("article", get_article_text(url))
+            script, text_cost_usd, complete = generate_script(
+                article_info, streaming=st.session_state.streaming_mode, checkpoint=checkpoint,
+                url=normalize_url(url), progressive=st.session_state.progressive_mode
+            )
             
-            # 総コストを表示
-            total_cost_usd = text_cost_usd
-            st.success(f"処理が完了しました！ 総コスト: {format_cost_jpy(total_cost_usd)}")
+            if script:
+                # 音声を再生
+                st.audio(script)
+                
+                # 音声ファイルのダウンロードボタン
+                with open(script, "rb") as f:
+                    if complete:
+                        st.download_button("音声をダウンロード", f, file_name="podcast.mp3", mime="audio/mp3")
+                    else:
+                        st.download_button("未完成の音声をダウンロード", f, file_name="podcast-incomplete.mp3",
+                                           mime="audio/mp3")
+                
+                total_cost_usd = text_cost_usd
+                if complete:
+                    # 音声履歴に追加して総コストを表示
+                    get_history_store().add(article_info['title'], script)
+                    st.success(f"処理が完了しました！ 総コスト: {format_cost_jpy(total_cost_usd)}")
+                else:
+                    # 欠けた部分のある音声は履歴に追加しない（再実行で完成したものを追加する）
+                    st.warning(
+                        "一部のセリフの音声が欠けているため、履歴には追加していません。"
+                        "もう一度実行すると、欠けた部分だけを生成し直します。"
+                        f" 総コスト: {format_cost_jpy(total_cost_usd)}"
+                    )
             
         except Exception as e:
-            st.error(f"エラーが発生しました: {str(e)}")
\ No newline at end of file
+            st.error(f"エラーが発生しました: {str(e)}")
+        finally:
+            if checkpoint:
+                checkpoint.release()
+            # 各段階の計測結果を書き出す
+            METRICS.export(METRICS_JSONL_PATH, METRICS_PROM_PATH)
\ No newline at end of file
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# newspaper は読み込みに時間がかかるので、記事を解析するときに import する
+from http_client import default_client, html_text
+from metrics import METRICS
+
+# 記事と要約のキャッシュの保存先
+ARTICLE_CACHE_DIR = "article_cache"
+
+# URLの正規化で取り除くクエリパラメーター（計測用）
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+
+def normalize_url(url):
+    """キャッシュのキーにするためにURLを正規化する
+
+    スキームとホストを小文字にし、既定のポート・フラグメント・計測用の
+    パラメーターを取り除き、クエリを並べ替える。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not (scheme == "http" and port == 80 or scheme == "https" and port == 443):
+        host = f"{host}:{port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith(TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def content_hash(article_info):
+    """記事の内容（タイトル・本文・画像）のハッシュを返す"""
+    payload = json.dumps(
+        [article_info['title'], article_info['text'], sorted(article_info['images'])],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ArticleCache:
+    """記事と要約をディスクに保存するキャッシュ
+
+    記事は正規化したURLごと、要約は記事の内容のハッシュごとに1ファイルで保存する。
+    """
+
+    def __init__(self, directory=ARTICLE_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "articles"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "summaries"), exist_ok=True)
+
+    def _path(self, kind, key):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, kind, f"{name}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        # 同じ記事を同時に保存するセッション（スレッド）と一時ファイルが重ならないようにする
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def get_article(self, url):
+        """キャッシュされた記事のエントリを返す（なければ None）"""
+        return self._read(self._path("articles", normalize_url(url)))
+
+    def put_article(self, url, entry):
+        self._write(self._path("articles", normalize_url(url)), entry)
+
+    def get_summary(self, key):
+        """記事の内容のハッシュに対応する要約を返す（なければ None）"""
+        entry = self._read(self._path("summaries", key))
+        return entry["summary"] if entry else None
+
+    def put_summary(self, key, summary):
+        self._write(self._path("summaries", key), {"summary": summary})
+
+
+def parse_article(url, html):
+    """取得済みのHTMLを newspaper で解析する"""
+    from newspaper import Article
+
+    article = Article(url, language='ja')
+    article.download(input_html=html)
+    article.parse()
+    return {
+        'text': article.text,
+        'title': article.title,
+        'images': sorted(article.images)
+    }
+
+
+def fetch_article(url, cache, client=None):
+    """記事を取得する（キャッシュがあれば条件付きGETで更新を確認する）
+
+    HTMLは共有のHTTPクライアント（client を省略すると http_client の既定の
+    クライアント）で取得し、newspaper には解析だけをさせる。
+    サーバーが 304 Not Modified を返したときはキャッシュした解析結果を使う。
+    戻り値の辞書には記事の内容のハッシュ（'content_hash'）が入る。
+    """
+    from newspaper import Config
+
+    client = client or default_client()
+    cached = cache.get_article(url)
+    headers = {"User-Agent": Config().browser_user_agent}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with METRICS.timer("article_fetch") as fields:
+        response = client.get(url, headers=headers)
+        fields["http_status"] = str(response.status_code)
+        fields["bytes"] = len(response.content)
+    if cached and response.status_code == 304:
+        return cached["article"]
+    response.raise_for_status()
+
+    with METRICS.timer("article_parse") as fields:
+        article_info = parse_article(url, html_text(response))
+        fields["chars"] = len(article_info['text'])
+    article_info['content_hash'] = content_hash(article_info)
+    cache.put_article(url, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "article": article_info,
+    })
+    return article_info
+
+
+def cached_summary(article_info, cache, summarize, model):
+    """内容が同じ記事の要約があれば再利用し、なければ summarize で要約して保存する
+
+    戻り値は (要約, キャッシュから取得したかどうか)。
+    """
+    key = f"{model}:{article_info.get('content_hash') or content_hash(article_info)}"
+    with METRICS.timer("summarize", model=model) as fields:
+        summary = cache.get_summary(key)
+        fields["cache"] = "hit" if summary is not None else "miss"
+        if summary is not None:
+            return summary, True
+
+        summary = summarize(article_info)
+        fields["chars"] = len(summary)
+    cache.put_summary(key, summary)
+    return summary, False
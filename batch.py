@@ -0,0 +1,354 @@
+"""記事のURLリストやRSSフィードから、Streamlitを使わずにまとめて音声を生成する
+
+    python batch.py urls.txt
+    python batch.py --feed https://example.com/rss.xml
+    python batch.py            # 中断したジョブだけを再開する
+
+記事の取得・LLM（要約と台本）・音声生成をそれぞれ別のスレッドプールで
+パイプライン処理する。ジョブの状態は SQLite に、段階ごとの途中結果
+（記事・要約・台本・セリフの音声）は checkpoints/ に保存するので、
+中断や失敗をしても同じコマンドで未完了の段階から処理を続けられる。
+完成したエピソードはアプリの生成履歴にも追加する。
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import tomllib
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import openai
+import summarizer
+from article_cache import ArticleCache, cached_summary, fetch_article, normalize_url
+from checkpoint import CheckpointStore, LayeredCache, job_id_for_url
+from cost_ledger import CostLedger
+from episode_store import EPISODE_MAX_AGE_DAYS, EPISODE_MAX_BYTES, EpisodeStore
+from history_store import HistoryStore
+from http_client import create_client, default_client
+from metrics import METRICS, METRICS_JSONL_FILE, METRICS_PROM_FILE
+from pipeline import build_script_prompt, render_episode, stream_script
+from script_text import split_script_by_speaker
+from segment_cache import SegmentCache
+from tts import TTS_MAX_INPUT_CHARS, TTS_MODEL
+
+# ジョブキューのデータベース
+JOB_DB = "batch_jobs.db"
+
+# バッチの音声キャッシュの保存先（SegmentCache のインデックスはプロセスごとに
+# メモリにあるので、実行中のアプリの tts_cache とは共有しない）
+BATCH_SEGMENT_CACHE_DIR = "tts_cache_batch"
+
+# Streamlit の secrets ファイル（APIキーの読み込みに使う）
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+# 完了していないジョブの状態
+ACTIVE_STATUSES = ("pending", "fetching", "summarizing", "scripting", "synthesizing")
+
+
+class JobQueue:
+    """URLごとのジョブの状態を保存するキュー"""
+
+    def __init__(self, path=JOB_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " url TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " title TEXT,"
+            " file TEXT,"
+            " cost_usd REAL,"
+            " error TEXT,"
+            " created_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def add(self, urls):
+        """ジョブを追加する（登録済みのURLはそのまま）"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (url, status, created_at, updated_at) VALUES (?, 'pending', ?, ?)",
+                [(url, now, now) for url in urls]
+            )
+
+    def runnable(self, retry_failed=False):
+        """処理するジョブのURLを登録順に返す（中断したジョブを含む）"""
+        statuses = ACTIVE_STATUSES + (("failed",) if retry_failed else ())
+        placeholders = ",".join("?" * len(statuses))
+        rows = self.conn.execute(
+            f"SELECT url FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at, rowid",
+            statuses
+        )
+        return [row[0] for row in rows]
+
+    def update(self, url, **fields):
+        """ジョブの状態を更新する"""
+        fields["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE jobs SET {columns} WHERE url = ?", (*fields.values(), url))
+
+    def summary(self):
+        """状態ごとのジョブ数を返す"""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+
+def read_url_list(path):
+    """1行1URLのファイルを読み込む（空行と # で始まる行は無視する）"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def read_feed(url):
+    """RSS 2.0 / Atom フィードから記事のURLを取り出す"""
+    response = default_client().get(url)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+
+    atom = "{http://www.w3.org/2005/Atom}"
+    if root.tag == f"{atom}feed":
+        urls = []
+        for entry in root.iter(f"{atom}entry"):
+            for link in entry.iter(f"{atom}link"):
+                if link.get("rel", "alternate") == "alternate" and link.get("href"):
+                    urls.append(link.get("href"))
+                    break
+    else:
+        urls = [item.findtext("link").strip() for item in root.iter("item") if item.findtext("link")]
+
+    # 重複を除く
+    return list(dict.fromkeys(urls))
+
+
+def load_secrets():
+    """Streamlit の secrets ファイルを読み込む（なければ空の辞書）"""
+    if os.path.exists(SECRETS_FILE):
+        with open(SECRETS_FILE, "rb") as f:
+            return tomllib.load(f)
+    return {}
+
+
+def load_api_key():
+    """環境変数か Streamlit の secrets ファイルから OpenAI のAPIキーを読み込む"""
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    return load_secrets().get("OPENAI_API_KEY")
+
+
+def run_batch(client, queue, urls, voices, fetch_workers=4, llm_workers=2, tts_workers=8,
+              episode_workers=2, retry_failed=False, normalize_mode="peak",
+              max_request_chars=TTS_MAX_INPUT_CHARS, metrics_jsonl=METRICS_JSONL_FILE,
+              metrics_prom=METRICS_PROM_FILE, segment_cache_dir=BATCH_SEGMENT_CACHE_DIR,
+              episode_max_bytes=EPISODE_MAX_BYTES, episode_max_age_days=EPISODE_MAX_AGE_DAYS):
+    """ジョブをパイプラインで処理する
+
+    各ジョブは 取得 → 要約 → 台本 → 音声 の順に進み、段階ごとに別の
+    スレッドプールで実行される。音声生成のリクエストは全エピソードで
+    tts_workers 個のスレッドを共有する。
+    APIの料金はリクエストごとに料金の記録（CostLedger）に追記し、ジョブの料金には
+    再開する前の実行の分も含める。各段階の計測結果は、ジョブが終わるたびに metrics_jsonl（JSONL）と
+    metrics_prom（Prometheus のテキスト形式）に書き出す。
+    音声キャッシュは segment_cache_dir に保存する（アプリとは共有しない）。
+    エピソードはアプリと同じ保存期間・容量の上限（episode_max_age_days, episode_max_bytes）で、
+    ジョブが完了するたびに古いものから削除する。
+    """
+    article_cache = ArticleCache()
+    segment_cache = SegmentCache(segment_cache_dir)
+    store = EpisodeStore(max_bytes=episode_max_bytes, max_age_days=episode_max_age_days)
+    checkpoints = CheckpointStore()
+    checkpoints.prune()
+    ledger = CostLedger()
+    history = HistoryStore()
+    # 記事の取得のスレッドで1つの接続プールを共有する（同じサイトへの接続を再利用する）
+    http = create_client(max_connections=fetch_workers, max_keepalive=fetch_workers)
+
+    def start(url):
+        # 再開したジョブは前回と同じ実行IDで料金を記録する
+        job = checkpoints.job(job_id_for_url(url))
+        run = job.load("run") or job.save("run", str(uuid.uuid4()))
+        return {"job": job, "run": run, "entry": {"article": normalize_url(url)}}
+
+    def fetch(job, url):
+        article_info = job.load("article")
+        if article_info is None:
+            article_info = job.save("article", fetch_article(url, article_cache, client=http))
+        return article_info
+
+    def summarize(state, article_info):
+        job = state["job"]
+        summary = job.load("summary")
+        if summary is None:
+            usage = []
+            try:
+                summary, _ = cached_summary(
+                    article_info, article_cache,
+                    lambda info: summarizer.summarize_article(client, info, usage=usage),
+                    summarizer.SUMMARY_MODEL
+                )
+            finally:
+                # 途中で失敗しても、それまでに済んだリクエストの料金は記録する
+                ledger.record_completions(state["run"], "summary", usage, **state["entry"])
+            job.save("summary", summary)
+        return summary
+
+    def write_script(state, article_info, summary):
+        job = state["job"]
+        script = job.load("script")
+        if script is None:
+            usage = []
+            prompt = build_script_prompt(article_info, summary)
+            try:
+                script = "".join(stream_script(client, prompt, usage=usage)).strip()
+            finally:
+                ledger.record_completions(state["run"], "script", usage, **state["entry"])
+            job.save("script", script)
+        return script
+
+    def synthesize(state, script):
+        # 音声生成の料金はAPIのリクエストが終わるたびに記録する（結合に失敗しても残る）
+        return render_episode(
+            client, split_script_by_speaker(script), voices, store,
+            cache=LayeredCache(state["job"], segment_cache),
+            normalize_mode=normalize_mode, executor=tts_pool, max_request_chars=max_request_chars,
+            on_billed=lambda chars: ledger.record_speech(state["run"], "tts", TTS_MODEL, [chars], **state["entry"])
+        )
+
+    queue.add(urls)
+    jobs = queue.runnable(retry_failed)
+    print(f"{len(jobs)}件のジョブを処理します")
+
+    fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+    llm_pool = ThreadPoolExecutor(max_workers=llm_workers)
+    tts_pool = ThreadPoolExecutor(max_workers=tts_workers)
+    episode_pool = ThreadPoolExecutor(max_workers=episode_workers)
+
+    # future → (URL, 段階, それまでの結果)
+    in_flight = {}
+    for url in jobs:
+        queue.update(url, status="fetching", error=None)
+        state = start(url)
+        in_flight[fetch_pool.submit(fetch, state["job"], url)] = (url, "fetch", state)
+
+    try:
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, stage, state = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    state["job"].release()
+                    queue.update(url, status="failed", error=f"{stage}: {e}")
+                    print(f"[失敗] {url} ({stage}): {e}")
+                    METRICS.export(metrics_jsonl, metrics_prom)
+                    continue
+
+                # 次の段階に進める
+                if stage == "fetch":
+                    state["article"] = result
+                    state["entry"]["title"] = result['title']
+                    queue.update(url, status="summarizing", title=result['title'])
+                    in_flight[llm_pool.submit(summarize, state, result)] = (url, "summary", state)
+                elif stage == "summary":
+                    queue.update(url, status="scripting")
+                    in_flight[llm_pool.submit(write_script, state, state["article"], result)] = (url, "script", state)
+                elif stage == "script":
+                    queue.update(url, status="synthesizing")
+                    in_flight[episode_pool.submit(synthesize, state, result)] = (url, "tts", state)
+                else:
+                    output_file, _, errors = result
+                    if output_file is None:
+                        # 音声が1つもできなかった台本は残さず、再実行では台本から作り直す
+                        state["job"].discard("script")
+                        state["job"].release()
+                        queue.update(url, status="failed", error="tts: 音声を生成できませんでした")
+                        print(f"[失敗] {url}: 音声を生成できませんでした")
+                        continue
+                    cost_usd = ledger.run_total(state["run"])
+                    if errors:
+                        # 台本と生成済みのセリフを残し、--retry-failed で失敗したセリフだけを生成し直す
+                        state["job"].release()
+                        queue.update(url, status="failed", file=output_file, cost_usd=cost_usd,
+                                     error=f"tts: {len(errors)}件のセリフの音声生成に失敗")
+                        print(f"[一部失敗] {url}: {len(errors)}件のセリフの音声生成に失敗しました"
+                              "（--retry-failed で再開できます）")
+                        METRICS.export(metrics_jsonl, metrics_prom)
+                        continue
+                    # 完了したので途中結果は不要
+                    state["job"].clear()
+                    queue.update(url, status="done", file=output_file, cost_usd=cost_usd, error=None)
+                    # アプリの生成履歴にも追加し、保存期間・容量の上限を超えたエピソードを削除する
+                    history.add(state['article']['title'], output_file)
+                    try:
+                        store.evict(keep=history.files())
+                    except OSError as e:
+                        print(f"[警告] 古いエピソードを削除できませんでした: {e}")
+                    print(f"[完了] {state['article']['title']} → {output_file} (${cost_usd:.4f})")
+                    METRICS.export(metrics_jsonl, metrics_prom)
+    finally:
+        for pool in (fetch_pool, llm_pool, episode_pool, tts_pool):
+            pool.shutdown(wait=True, cancel_futures=True)
+        # 中断したジョブのリースを返す（途中結果は次の実行で再開に使う）
+        for _, _, state in in_flight.values():
+            state["job"].release()
+        http.close()
+        METRICS.export(metrics_jsonl, metrics_prom)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url_file", nargs="?", help="1行1URLのファイル")
+    parser.add_argument("--feed", action="append", default=[], help="RSS/Atom フィードのURL（複数指定可）")
+    parser.add_argument("--db", default=JOB_DB, help="ジョブキューのデータベース")
+    parser.add_argument("--teacher-voice", default="alloy", help="先生役の音声")
+    parser.add_argument("--student-voice", default="nova", help="生徒役の音声")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="記事の取得の同時実行数")
+    parser.add_argument("--llm-workers", type=int, default=2, help="要約・台本生成の同時実行数")
+    parser.add_argument("--tts-workers", type=int, default=8, help="音声生成リクエストの同時実行数")
+    parser.add_argument("--episode-workers", type=int, default=2, help="同時に音声化するエピソード数")
+    parser.add_argument("--normalize", choices=["peak", "loudness"], default="peak",
+                        help="正規化の方法（loudness はデコードして結合し直す）")
+    parser.add_argument("--max-request-chars", type=int, default=TTS_MAX_INPUT_CHARS,
+                        help="同じ話者の連続したセリフをまとめる1リクエストの最大文字数（0 ならまとめない）")
+    parser.add_argument("--metrics-jsonl", default=METRICS_JSONL_FILE, help="計測結果（JSONL）の出力先")
+    parser.add_argument("--metrics-prom", default=METRICS_PROM_FILE,
+                        help="計測結果（Prometheus のテキスト形式）の出力先")
+    parser.add_argument("--segment-cache-dir", default=BATCH_SEGMENT_CACHE_DIR,
+                        help="音声キャッシュの保存先（アプリの実行中は tts_cache を指定しない）")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗したジョブもやり直す")
+    args = parser.parse_args()
+
+    api_key = load_api_key()
+    if not api_key:
+        sys.exit("OPENAI_API_KEY が設定されていません")
+
+    urls = read_url_list(args.url_file) if args.url_file else []
+    for feed in args.feed:
+        urls += read_feed(feed)
+
+    secrets = load_secrets()
+    queue = JobQueue(args.db)
+    client = openai.OpenAI(api_key=api_key)
+    start = time.perf_counter()
+    run_batch(
+        client, queue, urls,
+        voices={'teacher': args.teacher_voice, 'student': args.student_voice},
+        fetch_workers=args.fetch_workers, llm_workers=args.llm_workers,
+        tts_workers=args.tts_workers, episode_workers=args.episode_workers,
+        retry_failed=args.retry_failed, normalize_mode=args.normalize,
+        max_request_chars=args.max_request_chars, metrics_jsonl=args.metrics_jsonl,
+        metrics_prom=args.metrics_prom, segment_cache_dir=args.segment_cache_dir,
+        # 保存期間・容量の上限はアプリと同じ secrets の設定を使う
+        episode_max_bytes=int(secrets.get("EPISODE_MAX_BYTES", EPISODE_MAX_BYTES)),
+        episode_max_age_days=secrets.get("EPISODE_MAX_AGE_DAYS", EPISODE_MAX_AGE_DAYS)
+    )
+    print(f"処理時間: {time.perf_counter() - start:.1f}秒 / 状態: {queue.summary()}")
+
+
+if __name__ == "__main__":
+    main()
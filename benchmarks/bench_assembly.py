@@ -0,0 +1,149 @@
+"""エピソード組み立ての処理時間とピークメモリを比較するベンチマーク
+
+200セリフ程度の合成台本（MP3）を用意し、以前の方式（一時ファイル経由の
+デコードと毎回の np.concatenate）、assemble（デコードして最後に1回で結合）、
+concat_mp3（デコードせずにフレームを連結）、stream（ブロック単位で正規化して
+エンコードまで行う）を、それぞれ別プロセスで実行してピークRSSと処理時間を測る。
+
+    python benchmarks/bench_assembly.py --segments 200 --seconds 6
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import librosa
+import numpy as np
+
+from benchmarks.stub_server import make_mp3
+from loudness import write_normalized
+from mp3_frames import concat_mp3
+from tts import GAP_SECONDS, decode_segment, iter_decoded_segments
+
+
+def legacy_assemble(contents, directory):
+    """以前の generate_tts と同じ組み立て方"""
+    combined_audio = None
+    sr = None
+    for i, content in enumerate(contents):
+        temp_file = os.path.join(directory, f"temp_{i}.mp3")
+        with open(temp_file, "wb") as f:
+            f.write(content)
+        audio, current_sr = librosa.load(temp_file, sr=None)
+        if sr is None:
+            sr = current_sr
+        audio = librosa.util.normalize(audio)
+        if combined_audio is None:
+            combined_audio = audio
+        else:
+            silence = np.zeros(int(0.5 * sr))
+            combined_audio = np.concatenate([combined_audio, silence, audio])
+        os.remove(temp_file)
+    combined_audio = librosa.util.normalize(combined_audio)
+    return combined_audio, sr
+
+
+def batched_assemble(contents, gap_seconds=GAP_SECONDS):
+    """セリフの音声をデコード・正規化してリストに集め、最後に1回だけ結合する
+
+    （write_episode がストリーミングでエンコードするようになる前の方式）
+    """
+    parts = []
+    sr = None
+    silence = None
+    for content in contents:
+        # 2つ目以降は1つ目のサンプリングレートに揃える
+        audio, current_sr = decode_segment(content, sr)
+        if sr is None:
+            sr = current_sr
+            silence = np.zeros(int(gap_seconds * sr), dtype=audio.dtype)
+        if parts:
+            parts.append(silence)
+        parts.append(librosa.util.normalize(audio))
+
+    combined = np.concatenate(parts)
+    del parts
+
+    # 全体を正規化（コピーを作らないようにその場で割る）
+    peak = np.max(np.abs(combined))
+    if peak > 0:
+        combined /= peak
+    return combined, sr
+
+
+def run_mode(mode, segments, seconds):
+    """1つの方式を実行して結果をJSONで出力する（子プロセス用）"""
+    # 音程を変えた数種類の音声を使い回す
+    variants = [make_mp3(seconds, freq=220.0 + 55.0 * k) for k in range(4)]
+    contents = [variants[i % len(variants)] for i in range(segments)]
+
+    # MP3デコーダーの初期化分をどの方式からも除く
+    librosa.load(io.BytesIO(variants[0]), sr=None)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == "legacy":
+        with tempfile.TemporaryDirectory() as directory:
+            audio, sr = legacy_assemble(contents, directory)
+    elif mode == "assemble":
+        audio, sr = batched_assemble(contents)
+    elif mode == "concat":
+        data = concat_mp3(contents, 0.5)
+    else:
+        output_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False).name
+        decoded = iter_decoded_segments(contents)
+        write_normalized(decoded, output_file, next(decoded))
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if mode == "concat":
+        # 長さの確認用にデコードする（計測には含めない）
+        audio, sr = librosa.load(io.BytesIO(data), sr=None)
+    elif mode == "stream":
+        audio, sr = librosa.load(output_file, sr=None)
+        os.remove(output_file)
+
+    print(json.dumps({
+        "mode": mode,
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss / 1024,
+        "delta_rss_mb": (peak_rss - baseline_rss) / 1024,
+        "audio_minutes": len(audio) / sr / 60,
+        "dtype": str(audio.dtype),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--segments", type=int, default=200, help="セリフ数")
+    parser.add_argument("--seconds", type=float, default=6.0, help="1セリフの長さ（秒）")
+    parser.add_argument("--mode", choices=["legacy", "assemble", "concat", "stream"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.segments, args.seconds)
+        return
+
+    print(f"{'mode':>9} {'seconds':>9} {'peak RSS':>10} {'ΔRSS':>9} {'audio':>8}")
+    for mode in ["legacy", "assemble", "concat", "stream"]:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode,
+             "--segments", str(args.segments), "--seconds", str(args.seconds)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['mode']:>9} {result['seconds']:>9.2f} {result['peak_rss_mb']:>8.0f}MB "
+            f"{result['delta_rss_mb']:>7.0f}MB {result['audio_minutes']:>6.1f}分"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""記事の取得から音声の完成までを、ネットワークなしで通しで測るベンチマーク
+
+OpenAI API・記事のサイト・為替レートのAPIの代わりにローカルのスタブサーバー
+（stub_server）を立て、アプリ（Streamlit の AppTest）で「台本生成＆音声化」を
+エピソードの数だけ実行する。get_article_text → generate_script → generate_tts の
+本物の処理を通るので、エピソードごとの所要時間・スループット（エピソード/分）・
+ピークRSS・CPU時間を、同じ条件で何度でも比べられる。
+アプリは別プロセスの新しい作業ディレクトリ（キャッシュなし）で動かし、スタブの
+CPU時間は含めない。--baseline に git のコミットを指定すると、そのコミットと比較する。
+
+tiktoken のトークナイザーがダウンロードできない環境では、1文字を1トークンとして
+数える代わりのトークナイザーを使う（--tokenizer で指定もできる）。
+
+    python benchmarks/bench_end_to_end.py --episodes 5 --latency 0.2 --baseline HEAD~1
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_startup import patch_selectbox, prepare
+
+# 「台本生成＆音声化」ボタンのラベル
+GENERATE_BUTTON = "台本生成＆音声化"
+
+# 1エピソードを待つ時間の上限（秒）
+EPISODE_TIMEOUT = 600
+
+# 段階ごとの時間として表示するメトリクス（metrics.jsonl にあるもの）
+STAGE_METRICS = ("summarize", "llm_completion", "synthesize", "tts_request", "decode", "assemble")
+
+
+class CharEncoding:
+    """tiktoken の代わりに1文字を1トークンとして数える（日本語ではおおよそ同じ数になる）"""
+
+    def encode(self, text):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return "".join(map(chr, tokens))
+
+
+def use_tokenizer(mode):
+    """トークナイザーを選ぶ（auto は tiktoken が読み込めなければ chars にする）"""
+    import tiktoken
+
+    if mode == "auto":
+        try:
+            tiktoken.encoding_for_model("gpt-4")
+            return "tiktoken"
+        except Exception:
+            mode = "chars"
+    if mode == "chars":
+        encoding = CharEncoding()
+        tiktoken.encoding_for_model = lambda model: encoding
+        tiktoken.get_encoding = lambda name: encoding
+    return mode
+
+
+def cpu_seconds():
+    """このプロセスのCPU時間（ユーザー＋システム）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def stage_seconds(path):
+    """アプリが書き出した metrics.jsonl から、段階ごとの (回数, 合計秒) を集計する"""
+    stages = {}
+    if not os.path.exists(path):
+        return stages
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event["metric"] in STAGE_METRICS:
+                count, seconds = stages.get(event["metric"], (0, 0.0))
+                stages[event["metric"]] = (count + 1, seconds + event["seconds"])
+    return stages
+
+
+def set_checkbox(at, key, value):
+    """チェックボックスを設定する（そのコミットのアプリにない設定なら何もしない）"""
+    try:
+        at.checkbox(key=key).set_value(value)
+    except KeyError:
+        pass
+
+
+def run_child(app_dir, args):
+    """アプリでエピソードを生成して時間を測り、結果をJSONで出力する（子プロセス用）"""
+    from streamlit.testing.v1 import AppTest
+
+    tokenizer = use_tokenizer(args.tokenizer)
+    patch_selectbox()
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    stub_root = args.base_url.removesuffix("/v1")
+
+    at = AppTest.from_file(os.path.join(app_dir, "app.py"), default_timeout=EPISODE_TIMEOUT)
+    at.secrets["OPENAI_API_KEY"] = "bench"
+    at.secrets["EXCHANGE_RATE_URL"] = f"{stub_root}/rate"
+    at.run()
+    if at.exception:
+        raise SystemExit(f"アプリの実行に失敗しました: {at.exception[0].value}")
+    set_checkbox(at, "streaming_mode", not args.no_streaming)
+    set_checkbox(at, "progressive_mode", not args.no_progressive)
+
+    latencies = []
+    failed = 0
+    cpu_start = cpu_seconds()
+    wall_start = time.perf_counter()
+    for i in range(args.episodes):
+        at.text_input[0].input(f"{stub_root}/article/episode-{i}").run()
+        button = next(button for button in at.button if button.label == GENERATE_BUTTON)
+        start = time.perf_counter()
+        button.click().run()
+        latencies.append(time.perf_counter() - start)
+        if at.exception or not any("処理が完了しました" in message.value for message in at.success):
+            failed += 1
+
+    print(json.dumps({
+        "latencies": latencies,
+        "failed": failed,
+        "wall": time.perf_counter() - wall_start,
+        "cpu": cpu_seconds() - cpu_start,
+        # Linux の ru_maxrss はキロバイト
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tokenizer": tokenizer,
+        "stages": stage_seconds(os.path.join(app_dir, "metrics.jsonl")),
+    }))
+
+
+def measure(target, base_url, args):
+    """新しい作業ディレクトリ（データファイルなし）でアプリを起動して測る"""
+    options = ["--base-url", base_url, "--episodes", str(args.episodes), "--tokenizer", args.tokenizer]
+    options += ["--no-streaming"] if args.no_streaming else []
+    options += ["--no-progressive"] if args.no_progressive else []
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(target, directory)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", directory, *options],
+            check=True, capture_output=True, text=True, env={**os.environ, "OPENAI_BASE_URL": base_url}
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def percentile(values, p):
+    """values の p パーセンタイル（最近傍）"""
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * p / 100) - 1, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", help="比較するコミット（例: HEAD~1）")
+    parser.add_argument("--episodes", type=int, default=5, help="生成するエピソードの数")
+    parser.add_argument("--latency", type=float, default=0.2, help="OpenAI API の1リクエストの遅延（秒）")
+    parser.add_argument("--article-latency", type=float, default=0.1, help="記事と為替レートの取得の遅延（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="台本のストリーミングの間隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="OpenAI API が429を返す割合")
+    parser.add_argument("--article-error-rate", type=float, default=0.0, help="記事の取得が503になる割合")
+    parser.add_argument("--script-lines", type=int, default=20, help="台本のセリフ数")
+    parser.add_argument("--article-paragraphs", type=int, default=30, help="記事の段落数")
+    parser.add_argument("--audio-seconds", type=float, default=1.0, help="音声1回分の長さ（秒）")
+    parser.add_argument("--no-streaming", action="store_true", help="台本の完成を待ってから音声化する")
+    parser.add_argument("--no-progressive", action="store_true", help="できた部分からの再生を使わない")
+    parser.add_argument("--tokenizer", choices=("auto", "tiktoken", "chars"), default="auto",
+                        help="トークン数の数え方（chars は1文字を1トークンとする）")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        return
+
+    from benchmarks.stub_server import StubConfig, start_stub_server
+
+    # 記事ごとに台本の文面を変えて、エピソード間で音声のキャッシュが当たらないようにする
+    config = StubConfig(
+        latency=args.latency, article_latency=args.article_latency, token_interval=args.token_interval,
+        error_rate=args.error_rate, article_error_rate=args.article_error_rate,
+        script_lines=args.script_lines, article_paragraphs=args.article_paragraphs,
+        audio_seconds=args.audio_seconds, vary_script=True
+    )
+    server, base_url = start_stub_server(config)
+
+    targets = ([args.baseline] if args.baseline else []) + ["current"]
+    results = {}
+    try:
+        print(f"{'対象':<12}{'成功':>6}{'中央値':>9}{'p95':>9}{'最大':>9}{'件/分':>8}"
+              f"{'CPU時間':>10}{'ピークRSS':>11}{'リクエスト':>9}{'エラー':>6}")
+        for target in targets:
+            config.requests = config.errors = 0
+            result = measure(target, base_url, args)
+            results[target] = result
+            latencies = result["latencies"]
+            succeeded = len(latencies) - result["failed"]
+            print(
+                f"{target:<12}{succeeded:>3}/{len(latencies):<2}"
+                f"{percentile(latencies, 50):>8.2f}秒{percentile(latencies, 95):>8.2f}秒"
+                f"{max(latencies):>8.2f}秒{len(latencies) / result['wall'] * 60:>8.1f}"
+                f"{result['cpu']:>9.2f}秒{result['max_rss_mb']:>9.0f}MB"
+                f"{config.requests:>9}{config.errors:>6}"
+            )
+    finally:
+        server.shutdown()
+
+    for target, result in results.items():
+        if result["stages"]:
+            stages = "  ".join(
+                f"{name} {seconds:.2f}秒/{count}回" for name, (count, seconds) in result["stages"].items()
+            )
+            print(f"{target}: {stages}")
+    tokenizers = {result["tokenizer"] for result in results.values()}
+    if "chars" in tokenizers:
+        print("※ tiktoken の代わりに1文字を1トークンとして数えました")
+
+
+if __name__ == "__main__":
+    main()
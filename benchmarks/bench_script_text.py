@@ -0,0 +1,211 @@
+"""台本テキストの解析と変換の処理時間を比較するベンチマーク
+
+以前の実装（1文字ずつの文字列連結と line.replace による話者の除去）と、
+script_text の正規表現による1回走査の実装を、大きな日本語の台本で比較する。
+計測の前に、決まった入力に対する出力（ゴールデン）が期待どおりかを確認する。
+大きな台本（決まったシードで生成）は、出力全体のSHA-256を記録した値と比べ、
+セリフの分割は以前の実装・ストリーミングでの分割とも一致するかを確認する。
+
+    python benchmarks/bench_script_text.py --lines 5000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script_text import convert_to_ssml, iter_dialogues, split_script_by_speaker
+
+# (関数, 引数, 期待する出力)
+GOLDEN = [
+    (convert_to_ssml, ("こんにちは。元気ですか？",), "こんにちは。元気ですか？"),
+    (convert_to_ssml, ("文末の記号がない文",), "文末の記号がない文。"),
+    (convert_to_ssml, ("彼は「はい。わかりました」と言った",), "彼は、「はい。わかりました」と言った。"),
+    (convert_to_ssml, ("「例えば」の話です。 次の文！",), "、「例えば」の話です。次の文！"),
+    (convert_to_ssml, ("それで」次に進みます。",), "それで」、次に進みます。"),
+    (convert_to_ssml, ("閉じない「引用",), "閉じない、「引用。"),
+    (convert_to_ssml, ("A&Bの「引用」です。次へ",),
+     '<speak>A&amp;Bの<break time="200ms"/>「引用」です。<break time="400ms"/>次へ。</speak>'),
+    (split_script_by_speaker, ("前置き\nA: 比較すると B: の方が A:より大きい\nB：はい  \n  A:\nB: 最後",), [
+        {'speaker': 'teacher', 'text': '比較すると B: の方が A:より大きい'},
+        {'speaker': 'student', 'text': 'はい'},
+        {'speaker': 'student', 'text': '最後'},
+    ]),
+    (lambda chunks: list(iter_dialogues(chunks)), (["A: こん", "にち", "は\nB: は", "い\n\nA: 終わり"],), [
+        {'speaker': 'teacher', 'text': 'こんにちは'},
+        {'speaker': 'student', 'text': 'はい'},
+        {'speaker': 'teacher', 'text': '終わり'},
+    ]),
+]
+
+# ssml=True で呼ぶゴールデンの番号
+SSML_CASES = {6}
+
+# 大きな台本のゴールデン（make_script(LARGE_GOLDEN_LINES, LARGE_GOLDEN_LINE_CHARS) の出力の SHA-256）
+LARGE_GOLDEN_LINES = 2000
+LARGE_GOLDEN_LINE_CHARS = 200
+LARGE_GOLDEN_DIGESTS = {
+    "split_script_by_speaker": "8a129fcea26f92054e46f79d6fc91982795edb26a4117ff860e0315e503c933b",
+    "convert_to_ssml": "67f062129e9c20459f4023d2ea9795ab8d545dcc1c6582979642093f1ef3ef23",
+    "convert_to_ssml(ssml=True)": "36520773a0a8ddcf2024f521eb63c1c729170067773b72685657a6e339675878",
+}
+
+
+def legacy_split_script_by_speaker(script):
+    """以前の split_script_by_speaker"""
+    dialogues = []
+    for line in script.split('\n'):
+        line = line.strip()
+        if line.startswith('A:'):
+            dialogues.append({'speaker': 'teacher', 'text': line.replace('A:', '').strip()})
+        elif line.startswith('B:'):
+            dialogues.append({'speaker': 'student', 'text': line.replace('B:', '').strip()})
+    return dialogues
+
+
+def legacy_convert_to_ssml(text):
+    """以前の convert_to_ssml"""
+    sentences = []
+    current_sentence = ""
+    for char in text:
+        current_sentence += char
+        if char in ["。", "？", "！"]:
+            sentences.append(current_sentence.strip())
+            current_sentence = ""
+    if current_sentence:
+        sentences.append(current_sentence.strip())
+
+    processed_sentences = []
+    for sentence in sentences:
+        parts = []
+        current_part = ""
+        in_quote = False
+        for char in sentence:
+            if char == "「":
+                if current_part:
+                    parts.append(current_part)
+                current_part = "「"
+                in_quote = True
+            elif char == "」" and in_quote:
+                current_part += "」"
+                parts.append(current_part)
+                current_part = ""
+                in_quote = False
+            else:
+                current_part += char
+        if current_part:
+            parts.append(current_part)
+
+        processed_parts = []
+        for part in parts:
+            if part.startswith("「"):
+                processed_parts.append(f"、{part}")
+            elif part.endswith("」"):
+                processed_parts.append(f"{part}、")
+            else:
+                processed_parts.append(part)
+        processed_sentences.append("".join(processed_parts))
+    return "。".join(processed_sentences) + "。"
+
+
+def make_script(lines, line_chars, seed=0):
+    """引用や疑問文を含む大きな日本語の台本を作る"""
+    rng = random.Random(seed)
+    words = ["機械学習", "データ", "モデル", "例えば", "つまり", "重要な", "ポイント", "です", "ます", "、"]
+    script = []
+    for i in range(lines):
+        text = ""
+        while len(text) < line_chars:
+            text += "".join(rng.choice(words) for _ in range(rng.randint(3, 8)))
+            text += rng.choice(["。", "？", "！", f"「{rng.choice(words)}」と言います。"])
+        script.append(f"{'AB'[i % 2]}: {text}")
+    return "\n".join(script)
+
+
+def check_golden():
+    """ゴールデンの出力を確認する"""
+    for i, (func, args, expected) in enumerate(GOLDEN):
+        actual = func(*args, ssml=True) if i in SSML_CASES else func(*args)
+        if actual != expected:
+            raise SystemExit(f"ゴールデン{i + 1}が一致しません:\n  期待: {expected!r}\n  実際: {actual!r}")
+    print(f"ゴールデン: {len(GOLDEN)}件すべて一致")
+
+
+def digest(value):
+    """出力のSHA-256（リストや辞書はJSONにしてから）"""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def check_large_golden():
+    """大きな台本のゴールデンを確認する"""
+    script = make_script(LARGE_GOLDEN_LINES, LARGE_GOLDEN_LINE_CHARS)
+    dialogues = split_script_by_speaker(script)
+
+    # 生成した台本のセリフには「A:」などが含まれないので、以前の実装と同じ結果になる
+    if dialogues != legacy_split_script_by_speaker(script):
+        raise SystemExit("大きな台本の分割が以前の実装と一致しません")
+    chunks = [script[i:i + 4] for i in range(0, len(script), 4)]
+    if list(iter_dialogues(chunks)) != dialogues:
+        raise SystemExit("大きな台本のストリーミングでの分割が split_script_by_speaker と一致しません")
+
+    actual = {
+        "split_script_by_speaker": digest(dialogues),
+        "convert_to_ssml": digest("\n".join(convert_to_ssml(d['text']) for d in dialogues)),
+        "convert_to_ssml(ssml=True)": digest("\n".join(convert_to_ssml(d['text'], ssml=True) for d in dialogues)),
+    }
+    for name, expected in LARGE_GOLDEN_DIGESTS.items():
+        if actual[name] != expected:
+            raise SystemExit(f"大きな台本の {name} の出力が一致しません:\n  期待: {expected}\n  実際: {actual[name]}")
+    print(f"大きな台本のゴールデン: {LARGE_GOLDEN_LINES}行 / {len(script):,}文字の出力がすべて一致")
+
+
+def best_of(repeat, func, *args):
+    """repeat 回実行して最短の時間（秒）を返す"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=5000, help="台本の行数")
+    parser.add_argument("--line-chars", type=int, default=200, help="1行あたりのおおよその文字数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の回数（最短を表示）")
+    args = parser.parse_args()
+
+    check_golden()
+    check_large_golden()
+
+    script = make_script(args.lines, args.line_chars)
+    chunks = [script[i:i + 4] for i in range(0, len(script), 4)]
+    print(f"台本: {args.lines}行 / {len(script):,}文字")
+
+    legacy_texts = [d['text'] for d in legacy_split_script_by_speaker(script)]
+    texts = [d['text'] for d in split_script_by_speaker(script)]
+    results = [
+        ("split_script_by_speaker", best_of(args.repeat, legacy_split_script_by_speaker, script),
+         best_of(args.repeat, split_script_by_speaker, script)),
+        ("convert_to_ssml（全セリフ）",
+         best_of(args.repeat, lambda: [legacy_convert_to_ssml(t) for t in legacy_texts]),
+         best_of(args.repeat, lambda: [convert_to_ssml(t) for t in texts])),
+        ("iter_dialogues（4文字ずつ）", None, best_of(args.repeat, lambda: list(iter_dialogues(chunks)))),
+    ]
+    print(f"{'処理':<28}{'以前':>12}{'現在':>12}{'倍率':>8}")
+    for name, legacy, current in results:
+        if legacy is None:
+            print(f"{name:<28}{'-':>12}{current * 1000:>10.1f}ms{'-':>8}")
+        else:
+            print(f"{name:<28}{legacy * 1000:>10.1f}ms{current * 1000:>10.1f}ms{legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
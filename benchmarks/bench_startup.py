@@ -0,0 +1,116 @@
+"""アプリの起動（最初の描画）と再実行のオーバーヘッドを測るベンチマーク
+
+Streamlit の AppTest でアプリを別プロセスで起動し、プロセスの開始から
+最初の描画が終わるまでの時間と、その後の再実行（ボタン操作などで毎回
+スクリプト全体が実行される）1回あたりの時間を測る。
+--baseline に git のコミットを指定すると、そのコミットのアプリと比較する。
+
+    python benchmarks/bench_startup.py --baseline HEAD~1 --repeat 3
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def patch_selectbox():
+    """AppTest で format_func 付きの selectbox を再実行できるようにする
+
+    AppTest は format_func 付きの selectbox の値を再実行時に選択肢から探せないので、
+    表示名が値で始まる選択肢を探すようにする。
+    """
+    from streamlit.testing.v1.element_tree import Selectbox
+
+    find_index = Selectbox.index.fget
+
+    def index(self):
+        try:
+            return find_index(self)
+        except ValueError:
+            return next(i for i, option in enumerate(self.options) if option.startswith(str(self.value)))
+
+    Selectbox.index = property(index)
+
+
+def run_child(app_dir, reruns):
+    """アプリを起動して時間を測り、結果をJSONで出力する（子プロセス用）"""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    patch_selectbox()
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    at = AppTest.from_file(os.path.join(app_dir, "app.py"), default_timeout=120)
+    at.secrets["OPENAI_API_KEY"] = "bench"
+    at.run()
+    first_render = time.perf_counter() - start
+    if at.exception:
+        raise SystemExit(f"アプリの実行に失敗しました: {at.exception[0].value}")
+
+    rerun_start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    rerun = (time.perf_counter() - rerun_start) / reruns
+
+    heavy = [name for name in ("librosa", "numpy", "scipy", "newspaper", "openai", "tiktoken")
+             if name in sys.modules]
+    print(json.dumps({"first_render": first_render, "rerun": rerun, "loaded": heavy}))
+
+
+def prepare(target, directory):
+    """測定するアプリのソースを作業ディレクトリに用意する（current は作業ツリー）"""
+    if target == "current":
+        for name in os.listdir(ROOT):
+            if name.endswith(".py"):
+                shutil.copy(os.path.join(ROOT, name), directory)
+        if os.path.isdir(os.path.join(ROOT, ".streamlit")):
+            shutil.copytree(os.path.join(ROOT, ".streamlit"), os.path.join(directory, ".streamlit"))
+        return
+    archive = subprocess.run(
+        ["git", "-C", ROOT, "archive", "--format=tar", target], check=True, capture_output=True
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+
+
+def measure(target, reruns):
+    """新しい作業ディレクトリ（データファイルなし）で1回起動して測る"""
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(target, directory)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", directory, "--reruns", str(reruns)],
+            check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", help="比較するコミット（例: HEAD~1）")
+    parser.add_argument("--repeat", type=int, default=3, help="起動を測る回数（中央値を表示）")
+    parser.add_argument("--reruns", type=int, default=20, help="再実行を測る回数")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.reruns)
+        return
+
+    targets = ([args.baseline] if args.baseline else []) + ["current"]
+    print(f"{'対象':<12}{'最初の描画':>12}{'再実行':>12}  起動時に読み込まれた重いモジュール")
+    for target in targets:
+        results = [measure(target, args.reruns) for _ in range(args.repeat)]
+        results.sort(key=lambda result: result["first_render"])
+        median = results[len(results) // 2]
+        rerun = sorted(result["rerun"] for result in results)[len(results) // 2]
+        print(f"{target:<12}{median['first_render']:>10.2f}秒{rerun * 1000:>9.1f}ミリ秒  "
+              f"{', '.join(median['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
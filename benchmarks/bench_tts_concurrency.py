@@ -0,0 +1,55 @@
+"""TTSの並列数とスループットの関係を測るベンチマーク
+
+ローカルのスタブTTSサーバーに遅延とエラー（429）を入れて、
+synthesize_segments のワーカー数ごとの処理時間を比較する。
+
+    python benchmarks/bench_tts_concurrency.py --segments 150 --latency 0.3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai
+
+from benchmarks.stub_server import StubConfig, start_stub_server
+from tts import synthesize_segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--segments", type=int, default=150, help="セリフ数")
+    parser.add_argument("--latency", type=float, default=0.3, help="1リクエストの遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="429を返す割合")
+    parser.add_argument("--workers", default="1,2,4,8,16", help="試すワーカー数（カンマ区切り）")
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, error_rate=args.error_rate)
+    server, base_url = start_stub_server(config)
+    client = openai.OpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    segments = [{'text': f"セリフ{i}です。", 'voice': "alloy"} for i in range(args.segments)]
+
+    print(f"{'workers':>8} {'seconds':>9} {'seg/s':>8} {'speedup':>8} {'errors':>7} {'failed':>7}")
+    baseline = None
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            config.errors = 0
+            start = time.perf_counter()
+            contents, errors = synthesize_segments(
+                client, segments, max_workers=workers, backoff_base=0.05
+            )
+            elapsed = time.perf_counter() - start
+            if baseline is None:
+                baseline = elapsed
+            print(
+                f"{workers:>8} {elapsed:>9.2f} {len(segments) / elapsed:>8.1f} "
+                f"{baseline / elapsed:>7.1f}x {config.errors:>7} {len(errors):>7}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
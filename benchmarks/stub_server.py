@@ -0,0 +1,214 @@
+"""ベンチマーク用のローカルスタブサーバー
+
+OpenAI API の代わりに、指定した遅延・エラー率でレスポンスを返す。
+GET /article/<名前> では記事のHTMLを（名前ごとに内容を変えて、ETag付きで）返し、
+GET /rate では為替レートのAPIと同じ形式のJSONを返す。
+"""
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import soundfile as sf
+
+
+def make_script(lines=20, topic=""):
+    """スタブが返すポッドキャスト台本を作る（topic を入れるとセリフの文面が変わる）"""
+    script = []
+    for i in range(lines):
+        if i % 2 == 0:
+            script.append(f"A: {topic}{i // 2 + 1}つ目のポイントを説明します。「例えば」の話をしましょう。")
+        else:
+            script.append(f"B: なるほど、{topic}よくわかりました！")
+    return "\n".join(script)
+
+
+def make_article_html(paragraphs=30, name=""):
+    """スタブが返す記事のHTMLを作る（name ごとに本文が変わる）"""
+    body = "\n".join(
+        f"<p>これは{name}の{i + 1}段落目の本文です。記事の内容を説明するための文章が続きます。"
+        "重要なポイントは具体的な数字と一緒に紹介されています。</p>"
+        for i in range(paragraphs)
+    )
+    return (
+        f"<html><head><meta charset=\"utf-8\"><title>スタブ記事{name}</title></head>"
+        f"<body><article><h1>スタブ記事{name}</h1>{body}</article></body></html>"
+    )
+
+
+def make_mp3(seconds=1.0, sr=24000, freq=440.0):
+    """スタブが返すMP3のバイト列を作る（正弦波）"""
+    t = np.arange(int(seconds * sr)) / sr
+    audio = (0.3 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sr, format="MP3")
+    return buffer.getvalue()
+
+
+class StubConfig:
+    """スタブの挙動の設定"""
+
+    def __init__(self, latency=0.2, error_rate=0.0, error_status=429, audio_seconds=1.0,
+                 script_lines=20, token_interval=0.0, article_paragraphs=30,
+                 article_latency=None, article_error_rate=0.0, vary_script=False, jpy_rate=150.0):
+        self.latency = latency
+        self.article_latency = latency if article_latency is None else article_latency
+        self.article_error_rate = article_error_rate
+        self.article_paragraphs = article_paragraphs
+        self.articles = {}
+        self.script_lines = script_lines
+        self.script = make_script(script_lines)
+        # True のときはプロンプトごとに台本の文面を変える（記事ごとに別の音声になる）
+        self.vary_script = vary_script
+        self.token_interval = token_interval
+        self.jpy_rate = jpy_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.mp3 = make_mp3(audio_seconds)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _article_html(self, name):
+        config = self.config
+        with config.lock:
+            if name not in config.articles:
+                config.articles[name] = make_article_html(config.article_paragraphs, name).encode("utf-8")
+            return config.articles[name]
+
+    def _script_for(self, request):
+        config = self.config
+        if not config.vary_script:
+            return config.script
+        prompt = json.dumps(request.get("messages"), ensure_ascii=False).encode("utf-8")
+        return make_script(config.script_lines, f"話題{hashlib.sha256(prompt).hexdigest()[:6]}の")
+
+    def _send_completion(self, request):
+        config = self.config
+        script = self._script_for(request)
+        usage = {"prompt_tokens": 1000, "completion_tokens": len(script), "total_tokens": 1000 + len(script)}
+        if not request.get("stream"):
+            body = {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": script}}],
+                "usage": usage,
+            }
+            self._send(200, json.dumps(body).encode(), "application/json")
+            return
+
+        # ストリーミング（Server-Sent Events）で数文字ずつ返す
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for start in range(0, len(script), 4):
+            event = {
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"content": script[start:start + 4]}}],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            if config.token_interval:
+                time.sleep(config.token_interval)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event = {
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": request.get("model"),
+                "choices": [], "usage": usage,
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def do_GET(self):
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        time.sleep(config.article_latency)
+        if self.path.startswith("/rate"):
+            self._send(200, json.dumps({"base": "USD", "rates": {"JPY": config.jpy_rate}}).encode(),
+                       "application/json")
+            return
+        if not self.path.startswith("/article/"):
+            self._send(404, b"", "text/plain")
+            return
+        if random.random() < config.article_error_rate:
+            with config.lock:
+                config.errors += 1
+            self._send(503, b"stub error", "text/plain")
+            return
+
+        # 条件付きGETに対応する
+        html = self._article_html(self.path[len("/article/"):])
+        etag = '"' + hashlib.sha256(html).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send(200, html, "text/html; charset=utf-8", {"ETag": etag})
+
+    def do_POST(self):
+        config = self.config
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+
+        with config.lock:
+            config.requests += 1
+            config.active += 1
+            config.max_active = max(config.max_active, config.active)
+        try:
+            time.sleep(config.latency)
+            if random.random() < config.error_rate:
+                with config.lock:
+                    config.errors += 1
+                body = json.dumps({"error": {"message": "stub error", "type": "stub"}}).encode()
+                self._send(config.error_status, body, "application/json", {"retry-after": "0"})
+                return
+
+            if self.path.endswith("/audio/speech"):
+                self._send(200, config.mp3, "audio/mpeg")
+            elif self.path.endswith("/chat/completions"):
+                self._send_completion(json.loads(raw or b"{}"))
+            else:
+                self._send(404, b"{}", "application/json")
+        finally:
+            with config.lock:
+                config.active -= 1
+
+
+def start_stub_server(config):
+    """スタブサーバーを別スレッドで起動し、(サーバー, ベースURL) を返す"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}/v1"
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from article_cache import normalize_url
+
+# 途中結果の保存先
+CHECKPOINT_DIR = "checkpoints"
+
+# 途中結果を残しておく日数
+CHECKPOINT_MAX_AGE_DAYS = 7
+
+# 実行中のジョブの使用権（リース）の有効期限（秒）。途中結果を書き込むたびに延長し、
+# 期限が切れたリースは異常終了した実行のものとみなして引き継ぐ
+# （同じホストでリースを持つプロセスが終了していれば、期限を待たずに引き継ぐ）
+CHECKPOINT_LEASE_SECONDS = 2 * 3600
+
+# リースのファイル名
+LEASE_FILE = "lease"
+
+
+def job_id_for_url(url):
+    """記事のURLからジョブIDを作る（同じ記事の再実行は同じジョブになる）"""
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()[:32]
+
+
+class JobCheckpoint:
+    """1つのジョブの段階ごとの途中結果（記事・要約・台本・セリフの音声）
+
+    段階の結果は JSON、セリフの音声はキャッシュのキーをファイル名にして保存する。
+    SegmentCache と同じ get/put を持つので、音声キャッシュとして使える。
+    使用中の実行はリース（acquire/release）を持ち、同じジョブの別の実行と
+    途中結果を共有しないようにする（CheckpointStore.job を参照）。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.leased = False
+        os.makedirs(os.path.join(directory, "segments"), exist_ok=True)
+
+    def _lease_path(self):
+        return os.path.join(self.directory, LEASE_FILE)
+
+    def _stage_path(self, stage):
+        return os.path.join(self.directory, f"{stage}.json")
+
+    def _segment_path(self, key):
+        return os.path.join(self.directory, "segments", f"{key}.mp3")
+
+    def _lease_owner_alive(self):
+        """リースを持つプロセスが動いているか（別のホストなどで判断できなければ None）"""
+        try:
+            with open(self._lease_path(), "r", encoding="utf-8") as f:
+                owner = json.load(f)
+            if owner["host"] != socket.gethostname():
+                return None
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # 別のユーザーのプロセスとして動いている
+            return True
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return True
+
+    def _write(self, path, data, mode):
+        # 削除されていても書き込めるように保存先を作り直す
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        if self.leased:
+            # 書き込んでいる間はリースを延長する
+            try:
+                os.utime(self._lease_path())
+            except OSError:
+                pass
+
+    def acquire(self, lease_seconds=CHECKPOINT_LEASE_SECONDS):
+        """ジョブのリースを取る（別の実行が使用中なら False）"""
+        path = self._lease_path()
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                fd = None
+            if fd is not None:
+                # 異常終了を見分けられるように、リースを持つプロセスを記録する
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"host": socket.gethostname(), "pid": os.getpid()}, f)
+                self.leased = True
+                return True
+            try:
+                if (self._lease_owner_alive() is not False
+                        and time.time() - os.path.getmtime(path) < lease_seconds):
+                    return False
+                # 期限切れのリースを外して取り直す（同時に取り直した実行とは O_EXCL で決まる）
+                os.remove(path)
+            except OSError:
+                pass
+        return False
+
+    def release(self):
+        """ジョブのリースを返す（途中結果は残す）"""
+        if self.leased:
+            self.leased = False
+            try:
+                os.remove(self._lease_path())
+            except OSError:
+                pass
+
+    def load(self, stage):
+        """段階の結果を返す（まだなければ None）"""
+        try:
+            with open(self._stage_path(stage), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, stage, value):
+        """段階の結果を保存する"""
+        self._write(self._stage_path(stage), json.dumps(value, ensure_ascii=False), "w")
+        return value
+
+    def get(self, key):
+        """保存済みのセリフの音声を返す（なければ None）"""
+        try:
+            with open(self._segment_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def discard(self, stage):
+        """段階の結果を削除する（次の実行でその段階からやり直す）"""
+        try:
+            os.remove(self._stage_path(stage))
+        except OSError:
+            pass
+
+    def put(self, key, content):
+        """セリフの音声を保存する"""
+        self._write(self._segment_path(key), content, "wb")
+
+    def flush(self):
+        pass
+
+    def clear(self):
+        """ジョブが完了したら途中結果を削除する（リースも返す）"""
+        self.leased = False
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class CheckpointStore:
+    """ジョブIDごとの途中結果の保存先"""
+
+    def __init__(self, directory=CHECKPOINT_DIR, max_age_days=CHECKPOINT_MAX_AGE_DAYS,
+                 lease_seconds=CHECKPOINT_LEASE_SECONDS):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.lease_seconds = lease_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def job(self, job_id):
+        """ジョブの途中結果をリースを取って返す
+
+        同じジョブを別の実行（別のセッションや、正規化すると同じURLになる
+        バッチの行）が使用中なら、その途中結果を消したり上書きしたりしないように、
+        この実行だけの保存先を返す。使い終わったら release か clear を呼ぶ。
+        """
+        checkpoint = JobCheckpoint(os.path.join(self.directory, job_id))
+        if checkpoint.acquire(self.lease_seconds):
+            return checkpoint
+        private = JobCheckpoint(os.path.join(self.directory, f"{job_id}-{uuid.uuid4().hex[:8]}"))
+        private.acquire(self.lease_seconds)
+        return private
+
+    def prune(self):
+        """長い間再開されなかったジョブの途中結果を削除する"""
+        limit = time.time() - self.max_age_days * 86400
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and os.path.getmtime(path) < limit:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class LayeredCache:
+    """ジョブの途中結果を優先し、なければ共有の音声キャッシュを使う
+
+    共有キャッシュから見つかった音声や新しく生成した音声は、
+    ジョブの途中結果にも保存する（共有キャッシュから追い出されても再開できる）。
+    新しく生成した音声は先に共有キャッシュに保存する（料金を払った音声を失わないように）。
+    """
+
+    def __init__(self, checkpoint, shared=None):
+        self.checkpoint = checkpoint
+        self.shared = shared
+
+    def get(self, key):
+        content = self.checkpoint.get(key)
+        if content is None and self.shared is not None:
+            content = self.shared.get(key)
+            if content is not None:
+                self.checkpoint.put(key, content)
+        return content
+
+    def put(self, key, content):
+        if self.shared is not None:
+            self.shared.put(key, content)
+        self.checkpoint.put(key, content)
+
+    def flush(self):
+        if self.shared is not None:
+            self.shared.flush()
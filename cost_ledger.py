@@ -0,0 +1,132 @@
+"""APIの利用料金の記録
+
+要約・台本・音声生成のリクエストごとに、トークン数（APIの応答の usage から）・
+文字数・料金を SQLite に追記する。1回の生成（ジョブ）ごと、日ごと、
+記事ごとに集計できる。
+"""
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# 料金の記録のデータベース
+COST_LEDGER_DB = "cost_ledger.db"
+
+# チャットのモデルの料金（USD / 1Kトークン、入力と出力）
+COMPLETION_PRICES = {
+    "gpt-4": (0.03, 0.06),
+}
+
+# 音声生成のモデルの料金（USD / 1K文字）
+SPEECH_PRICES = {
+    "tts-1": 0.015,
+    "tts-1-hd": 0.03,
+}
+
+
+def completion_cost_usd(model, prompt_tokens, completion_tokens):
+    """チャットのリクエストの料金（USD）を計算する"""
+    input_price, output_price = COMPLETION_PRICES[model]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+
+
+def speech_cost_usd(model, chars):
+    """音声生成の料金（USD）を計算する"""
+    return (chars * SPEECH_PRICES[model]) / 1000
+
+
+class CostLedger:
+    """リクエストごとの料金を追記するだけの台帳"""
+
+    def __init__(self, path=COST_LEDGER_DB):
+        # Streamlit のセッションやバッチのスレッドから共有するのでロックで守る
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS costs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " created_at TEXT NOT NULL,"
+                " run TEXT NOT NULL,"
+                " article TEXT,"
+                " title TEXT,"
+                " stage TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " prompt_tokens INTEGER NOT NULL DEFAULT 0,"
+                " completion_tokens INTEGER NOT NULL DEFAULT 0,"
+                " chars INTEGER NOT NULL DEFAULT 0,"
+                " cost_usd REAL NOT NULL,"
+                " source TEXT NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS costs_run ON costs (run)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS costs_created_at ON costs (created_at)")
+
+    def record(self, run, stage, model, cost_usd, prompt_tokens=0, completion_tokens=0, chars=0,
+               source="usage", article=None, title=None):
+        """1件のリクエストの料金を記録する
+
+        source は 'usage'（APIの応答のトークン数）か 'estimate'（手元で数えたトークン数）。
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO costs (created_at, run, article, title, stage, model, prompt_tokens,"
+                " completion_tokens, chars, cost_usd, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), run, article, title, stage, model,
+                 prompt_tokens, completion_tokens, chars, cost_usd, source)
+            )
+
+    def record_completions(self, run, stage, usage, article=None, title=None):
+        """チャットのリクエストの usage（{'model', 'prompt_tokens', 'completion_tokens', 'source'}
+        のリスト）をまとめて記録し、料金の合計を返す"""
+        total = 0.0
+        for entry in usage:
+            cost = completion_cost_usd(entry['model'], entry['prompt_tokens'], entry['completion_tokens'])
+            self.record(run, stage, entry['model'], cost, entry['prompt_tokens'], entry['completion_tokens'],
+                        source=entry.get('source', 'usage'), article=article, title=title)
+            total += cost
+        return total
+
+    def record_speech(self, run, stage, model, requests, article=None, title=None):
+        """音声生成のリクエストごとの文字数のリストを1件ずつ記録し、料金の合計を返す"""
+        total = 0.0
+        for chars in requests:
+            cost = speech_cost_usd(model, chars)
+            self.record(run, stage, model, cost, chars=chars, article=article, title=title)
+            total += cost
+        return total
+
+    def run_breakdown(self, run):
+        """1回の生成の段階・モデルごとの内訳を返す
+
+        [(段階, モデル, リクエスト数, 入力トークン, 出力トークン, 文字数, 料金), ...]
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT stage, model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(chars),"
+                " SUM(cost_usd) FROM costs WHERE run = ? GROUP BY stage, model ORDER BY MIN(id)",
+                (run,)
+            ).fetchall()
+
+    def run_total(self, run):
+        """1回の生成の料金の合計（USD）を返す"""
+        with self.lock:
+            row = self.conn.execute("SELECT SUM(cost_usd) FROM costs WHERE run = ?", (run,)).fetchone()
+        return row[0] or 0.0
+
+    def daily_totals(self, days=7):
+        """直近 days 日の日ごとの料金を新しい順に返す [(日付, 料金, 生成回数), ...]"""
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        with self.lock:
+            return self.conn.execute(
+                "SELECT substr(created_at, 1, 10) AS day, SUM(cost_usd), COUNT(DISTINCT run)"
+                " FROM costs WHERE created_at >= ? GROUP BY day ORDER BY day DESC",
+                (since,)
+            ).fetchall()
+
+    def article_totals(self, limit=10):
+        """記事ごとの料金を高い順に返す [(記事, タイトル, 料金, 生成回数), ...]"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT article, MAX(title), SUM(cost_usd) AS total, COUNT(DISTINCT run)"
+                " FROM costs WHERE article IS NOT NULL GROUP BY article ORDER BY total DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+# エピソードの保存先
+EPISODE_DIR = "episodes"
+
+# 保存するエピソードの容量の上限（バイト、None なら無制限）
+EPISODE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# エピソードを保存しておく日数（None なら無期限）
+EPISODE_MAX_AGE_DAYS = None
+
+
+def file_digest(path):
+    """ファイルの内容の SHA-256 を返す"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EpisodeStore:
+    """生成したエピソードを内容のハッシュで名前を付けて保存する
+
+    リクエストごとに専用の一時ファイルに書き出してから、ハッシュ名のファイルへ
+    アトミックに置き換えるので、同時に生成しても互いの音声を上書きしない。
+    同じ内容のエピソードは1つのファイルにまとめる。
+    """
+
+    def __init__(self, directory=EPISODE_DIR, max_bytes=EPISODE_MAX_BYTES,
+                 max_age_days=EPISODE_MAX_AGE_DAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def temp_path(self, suffix=".mp3"):
+        """書き込み用の一時ファイルのパスを返す（保存先と同じディレクトリ）"""
+        return os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}{suffix}")
+
+    def commit(self, temp_path, suffix=".mp3"):
+        """一時ファイルをハッシュ名のファイルとして確定し、そのパスを返す"""
+        path = os.path.join(self.directory, f"{file_digest(temp_path)}{suffix}")
+        with self.lock:
+            if os.path.exists(path):
+                # 同じ内容のエピソードがすでにあればそれを使う
+                os.remove(temp_path)
+                os.utime(path)
+            else:
+                os.replace(temp_path, path)
+        return path
+
+    def discard(self, temp_path):
+        """確定しなかった一時ファイルを削除する"""
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def evict(self, keep=()):
+        """保存期間と容量の上限に従って古いエピソードを削除する
+
+        keep に含まれるファイル（履歴から参照されているものなど）は後回しにし、
+        それ以外を削除しても上限を超える場合にだけ削除する。
+        削除したファイルのパスのリストを返す。
+        別のスレッドやプロセス（履歴の削除など）が同時に削除したファイルは飛ばす。
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        now = time.time()
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((os.path.abspath(path) in keep, stat.st_mtime, stat.st_size, path))
+
+            # 参照されていないもの → 古いもの の順に削除候補にする
+            entries.sort()
+            total_bytes = sum(entry[2] for entry in entries)
+            removed = []
+            for kept, mtime, size, path in entries:
+                expired = self.max_age_days is not None and now - mtime > self.max_age_days * 86400
+                over = self.max_bytes is not None and total_bytes > self.max_bytes
+                if not expired and not over:
+                    continue
+                total_bytes -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed.append(path)
+            return removed
@@ -0,0 +1,93 @@
+"""生成履歴の保存
+
+履歴は SQLite に1件1行で保存する（追加・削除のたびにファイル全体を
+書き直さない）。新しい順にページ単位で読み出せる。
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+# 履歴のデータベース
+HISTORY_DB = "audio_history.db"
+
+# 以前の形式（JSON）の履歴ファイル。あれば最初に1回だけ取り込む
+LEGACY_HISTORY_FILE = "audio_history.json"
+
+
+class HistoryStore:
+    """生成履歴（タイトル・音声ファイル・日時）の保存先"""
+
+    def __init__(self, path=HISTORY_DB, legacy_file=LEGACY_HISTORY_FILE):
+        # Streamlit のセッションやバッチのスレッドから共有するのでロックで守る
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " id TEXT NOT NULL UNIQUE,"
+                " title TEXT NOT NULL,"
+                " file TEXT NOT NULL,"
+                " timestamp TEXT NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS history_file ON history (file)")
+        if legacy_file and os.path.exists(legacy_file):
+            self.import_json(legacy_file)
+
+    def import_json(self, path):
+        """JSON形式の履歴を取り込み、取り込んだファイルは名前を変えて残す"""
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO history (id, title, file, timestamp) VALUES (?, ?, ?, ?)",
+                [(item['id'], item['title'], item['file'], item['timestamp']) for item in items]
+            )
+        os.replace(path, f"{path}.migrated")
+
+    def add(self, title, file):
+        """履歴を追加し、追加した項目を返す"""
+        item = {
+            'id': str(uuid.uuid4()),
+            'title': title,
+            'file': file,
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO history (id, title, file, timestamp) VALUES (:id, :title, :file, :timestamp)",
+                item
+            )
+        return item
+
+    def delete(self, item_id):
+        """履歴を削除する"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM history WHERE id = ?", (item_id,))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def page(self, limit, offset=0):
+        """新しい順に limit 件の履歴を返す"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, title, file, timestamp FROM history ORDER BY seq DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def references(self, file):
+        """同じ音声ファイルを参照している履歴の数を返す"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history WHERE file = ?", (file,)).fetchone()[0]
+
+    def files(self):
+        """履歴から参照されている音声ファイルの一覧を返す"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT file FROM history")]
@@ -0,0 +1,108 @@
+"""記事の取得や為替レートの取得に使う共有のHTTPクライアント
+
+接続プール（keep-alive）・タイムアウト・同時接続数の上限を設定した
+httpx.Client を1つ作って、スレッド間で共有する。
+"""
+import re
+import threading
+import time
+
+import httpx
+
+# タイムアウト（秒）。接続は短く、応答の読み込みは記事の大きさを考えて長めにする
+HTTP_CONNECT_TIMEOUT = 5.0
+HTTP_READ_TIMEOUT = 20.0
+
+# 同時接続数と、再利用のために保持する接続数の上限
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE = 10
+
+# HTMLの先頭から文字コードの指定（<meta charset>）を探す
+META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_\-]+)""", re.IGNORECASE)
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def create_client(connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                  max_connections=HTTP_MAX_CONNECTIONS, max_keepalive=HTTP_MAX_KEEPALIVE):
+    """接続プールを持つHTTPクライアントを作る（スレッドセーフ）"""
+    return httpx.Client(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        follow_redirects=True,
+    )
+
+
+def default_client():
+    """プロセスで共有する既定のHTTPクライアントを返す"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = create_client()
+        return _default_client
+
+
+def html_text(response):
+    """HTMLの応答を文字列にする
+
+    Content-Type に文字コードがなければ <meta charset> を探す
+    （Shift_JIS や EUC-JP のページを UTF-8 として読まないように）。
+    """
+    if "charset" not in response.headers.get("content-type", "").lower():
+        match = META_CHARSET.search(response.content[:4096])
+        if match:
+            try:
+                return response.content.decode(match.group(1).decode("ascii"), errors="replace")
+            except LookupError:
+                pass
+    return response.text
+
+
+class StaleWhileRevalidate:
+    """値を max_age 秒キャッシュし、古くなったらバックグラウンドで更新する
+
+    更新中や更新に失敗したときは古い値を返すので、呼び出し元が待たされない。
+    まだ値がないときだけ、その場で読み込む（失敗したら None を返し、
+    retry_after 秒後にバックグラウンドで読み込み直す）。
+    """
+
+    def __init__(self, load, max_age, retry_after=60):
+        self.load = load
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.value = None
+        self.updated_at = None
+        self.failed_at = None
+        self.refreshing = False
+
+    def _refresh(self):
+        try:
+            value = self.load()
+        except Exception:
+            with self.lock:
+                self.failed_at = time.monotonic()
+                self.refreshing = False
+            return
+        with self.lock:
+            self.value = value
+            self.updated_at = time.monotonic()
+            self.failed_at = None
+            self.refreshing = False
+
+    def get(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.updated_at is not None and now - self.updated_at < self.max_age:
+                return self.value
+            if self.refreshing or (self.failed_at is not None and now - self.failed_at < self.retry_after):
+                return self.value
+            self.refreshing = True
+            first = self.value is None and self.failed_at is None
+
+        if first:
+            self._refresh()
+        else:
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return self.value
@@ -0,0 +1,162 @@
+"""音声を一定サイズのブロックごとに正規化してファイルに書き出す
+
+エピソード全体を配列としてメモリに持たずに済むように、1回目の走査で
+ピークとラウドネス（ITU-R BS.1770 の K 特性、ゲート付き）を測りながら
+デコード済みの音声を一時ファイルに退避し、2回目の走査でゲインを掛けて
+ブロックごとにエンコードする。
+"""
+import math
+import tempfile
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter
+
+from metrics import METRICS
+
+# 1回に処理するサンプル数
+BLOCK_SIZE = 65536
+
+# ラウドネス正規化の目標値（LUFS）
+TARGET_LUFS = -16.0
+
+# ピーク正規化の目標値（フルスケールに対する比）
+TARGET_PEAK = 1.0
+
+
+def k_weighting(sr):
+    """BS.1770 の K 特性フィルター（シェルビング + ハイパス）の係数を返す"""
+    # 1段目: 高域シェルビングフィルター
+    gain_db, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * math.pi * fc / sr
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    shelf_b = [
+        a * ((a + 1) + (a - 1) * cos_w0 + 2 * math.sqrt(a) * alpha),
+        -2 * a * ((a - 1) + (a + 1) * cos_w0),
+        a * ((a + 1) + (a - 1) * cos_w0 - 2 * math.sqrt(a) * alpha),
+    ]
+    shelf_a = [
+        (a + 1) - (a - 1) * cos_w0 + 2 * math.sqrt(a) * alpha,
+        2 * ((a - 1) - (a + 1) * cos_w0),
+        (a + 1) - (a - 1) * cos_w0 - 2 * math.sqrt(a) * alpha,
+    ]
+
+    # 2段目: ハイパスフィルター
+    q, fc = 0.5003270373238773, 38.13547087602444
+    w0 = 2 * math.pi * fc / sr
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    highpass_b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    highpass_a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+
+    return [
+        (np.array(shelf_b) / shelf_a[0], np.array(shelf_a) / shelf_a[0]),
+        (np.array(highpass_b) / highpass_a[0], np.array(highpass_a) / highpass_a[0]),
+    ]
+
+
+class LoudnessMeter:
+    """ブロックを順に受け取り、ピークと統合ラウドネスを測る"""
+
+    def __init__(self, sr):
+        self.sr = sr
+        self.filters = k_weighting(sr)
+        self.states = [np.zeros(2) for _ in self.filters]
+        # 100ms ごとの二乗平均（400ms のゲートブロックを 75% 重ねて作る）
+        self.step = int(0.1 * sr)
+        self.pending = np.zeros(0)
+        self.mean_squares = []
+        self.peak = 0.0
+
+    def feed(self, block):
+        """ブロックを追加する"""
+        if not len(block):
+            return
+        self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+        weighted = block.astype(np.float64)
+        for i, (b, a) in enumerate(self.filters):
+            weighted, self.states[i] = lfilter(b, a, weighted, zi=self.states[i])
+
+        weighted = np.concatenate([self.pending, weighted])
+        count = len(weighted) // self.step
+        if count:
+            steps = weighted[:count * self.step].reshape(count, self.step)
+            self.mean_squares.extend(np.mean(steps ** 2, axis=1).tolist())
+        self.pending = weighted[count * self.step:]
+
+    def integrated(self):
+        """ゲート付きの統合ラウドネス（LUFS）を返す（無音なら -inf）"""
+        steps = np.array(self.mean_squares)
+        if len(steps) < 4:
+            steps = np.append(steps, np.mean(self.pending ** 2) if len(self.pending) else 0.0)
+            blocks = np.array([steps.mean()])
+        else:
+            blocks = np.convolve(steps, np.ones(4) / 4, mode="valid")
+
+        def to_lufs(mean_square):
+            return -0.691 + 10 * np.log10(np.maximum(mean_square, 1e-20))
+
+        # 絶対ゲート（-70 LUFS）と相対ゲート（-10 LU）
+        blocks = blocks[to_lufs(blocks) > -70]
+        if not len(blocks):
+            return float("-inf")
+        blocks = blocks[to_lufs(blocks) > to_lufs(blocks.mean()) - 10]
+        return float(to_lufs(blocks.mean()))
+
+
+def normalization_gain(meter, mode="peak", target_lufs=TARGET_LUFS, target_peak=TARGET_PEAK):
+    """測定結果から掛けるゲイン（倍率）を決める
+
+    mode が 'loudness' のときは目標ラウドネスに合わせ、ピークが目標ピークを
+    超えないように抑える。'peak' のときはピークを目標ピークに合わせる。
+    """
+    if meter.peak <= 0:
+        return 1.0
+    peak_gain = target_peak / meter.peak
+    if mode == "peak":
+        return peak_gain
+
+    loudness = meter.integrated()
+    if not math.isfinite(loudness):
+        return 1.0
+    return min(10 ** ((target_lufs - loudness) / 20), peak_gain)
+
+
+def write_normalized(blocks, output_file, sr, mode="peak", target_lufs=TARGET_LUFS,
+                     target_peak=TARGET_PEAK, block_size=BLOCK_SIZE):
+    """モノラル音声のブロックを正規化しながら output_file に書き出す
+
+    blocks は float32 の配列のイテレータ（長さは自由）。
+    1回目の走査で測定と一時ファイルへの退避を行い、2回目の走査で
+    block_size サンプルずつゲインを掛けてエンコードするので、
+    メモリ使用量はエピソードの長さに依存しない。
+    戻り値は掛けたゲイン（倍率）。
+    """
+    meter = LoudnessMeter(sr)
+    with tempfile.TemporaryFile() as spool:
+        # 1回目: 測定しながらデコード済みの音声を退避
+        for block in blocks:
+            block = np.asarray(block, dtype=np.float32)
+            meter.feed(block)
+            block.tofile(spool)
+
+        gain = normalization_gain(meter, mode, target_lufs, target_peak)
+
+        # 2回目: ゲインを掛けてブロックごとにエンコード
+        spool.seek(0)
+        with METRICS.timer("encode", mode=mode) as fields, \
+                sf.SoundFile(output_file, "w", samplerate=sr, channels=1) as out:
+            fields["samples"] = 0
+            while True:
+                block = np.fromfile(spool, dtype=np.float32, count=block_size)
+                if not len(block):
+                    break
+                block *= gain
+                np.clip(block, -1.0, 1.0, out=block)
+                out.write(block)
+                fields["samples"] += len(block)
+
+    return gain
@@ -0,0 +1,174 @@
+"""パイプラインの計測（処理時間・バイト数・トークン数・リトライ回数）
+
+各段階の処理を METRICS.timer() で囲むと、処理時間を Prometheus 形式の
+ヒストグラムに集計し、1回ごとの記録を JSONL に書き出せるように残す。
+
+    with METRICS.timer("tts_request", voice=voice) as fields:
+        content = ...
+        fields["bytes"] = len(content)
+
+fields に入れた数値はイベントに記録され、同じ名前の累計カウンター
+（例: podcast_tts_request_bytes_total）にも加算される。
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 1回ごとの記録（JSONL）の保存先
+METRICS_JSONL_FILE = "metrics.jsonl"
+
+# Prometheus のテキスト形式の保存先（node_exporter の textfile collector 向け）
+METRICS_PROM_FILE = "metrics.prom"
+
+# メトリクス名の接頭辞
+METRIC_PREFIX = "podcast"
+
+# 処理時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labels):
+    """ラベルを Prometheus の {key="value"} 形式にする"""
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """スレッドセーフなメトリクスの集計"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # ファイルへの書き出しをスレッド（セッション）間で排他する
+        self.export_lock = threading.Lock()
+        # (名前, ラベル) → 値
+        self.counters = {}
+        # (名前, ラベル) → [区切りごとの件数..., 件数, 合計]
+        self.histograms = {}
+        # JSONL に書き出していない記録
+        self.events = []
+
+    def increment(self, name, value=1, **labels):
+        """カウンターに value を加算する"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """処理時間をヒストグラムに加える"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """囲んだ処理の時間を計測する
+
+        返される辞書に入れた値（bytes, tokens など）はイベントに記録され、
+        数値は <名前>_<キー>_total のカウンターに加算される。
+        例外で抜けた場合は status="error" として記録する。
+        """
+        fields = {}
+        status = "ok"
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(f"{name}_seconds", seconds, status=status, **labels)
+            for key, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.increment(f"{name}_{key}_total", value, **labels)
+            with self.lock:
+                self.events.append({
+                    "time": time.time(),
+                    "metric": name,
+                    "seconds": round(seconds, 6),
+                    "status": status,
+                    **labels,
+                    **fields,
+                })
+
+    def drain_events(self):
+        """書き出していない記録を取り出す"""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def write_jsonl(self, path=METRICS_JSONL_FILE):
+        """書き出していない記録を JSONL ファイルに追記する"""
+        events = self.drain_events()
+        if not events:
+            return
+        with open(path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def prometheus_text(self):
+        """集計を Prometheus のテキスト形式で返す"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(value)) for key, value in self.histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram[-2]}")
+            lines.append(f"{metric}_count{format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {histogram[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_PROM_FILE):
+        """集計を Prometheus のテキスト形式でファイルに書き出す（アトミックに置き換える）"""
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    def export(self, jsonl_path=METRICS_JSONL_FILE, prom_path=METRICS_PROM_FILE):
+        """記録と集計をファイルに書き出す（None の出力先は書き出さない）
+
+        書き出しに失敗しても例外は出さない（計測のために生成を失敗させないため）。
+        """
+        try:
+            with self.export_lock:
+                if jsonl_path:
+                    self.write_jsonl(jsonl_path)
+                else:
+                    self.drain_events()
+                if prom_path:
+                    self.write_prometheus(prom_path)
+        except Exception:
+            pass
+
+
+# プロセス全体で共有する集計
+METRICS = Metrics()
@@ -0,0 +1,179 @@
+"""MP3をデコードせずにフレーム単位で結合する
+
+同じ形式（MPEGバージョン・サンプリングレート・チャンネル）のMP3であれば、
+フレームをそのまま並べるだけで1つのMP3になる。
+セリフの間の無音は、同じ形式の「無音フレーム」を作って挿入し、
+先頭に全体のフレーム数を書いた Xing/Info フレームを付ける。
+"""
+import struct
+
+# Layer III のビットレート（kbps）。MPEG1 と MPEG2/2.5 で表が異なる
+BITRATES = {
+    "mpeg1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "mpeg2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# サンプリングレート（Hz）
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG1
+    2: [22050, 24000, 16000],  # MPEG2
+    0: [11025, 12000, 8000],   # MPEG2.5
+}
+
+
+class MP3FormatError(ValueError):
+    """フレーム単位で扱えないMP3"""
+
+
+def parse_header(data, offset):
+    """offset の位置にある Layer III のフレームヘッダーを解析する（なければ None）"""
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES["mpeg1" if mpeg1 else "mpeg2"][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channel_mode = b3 >> 6
+    mono = channel_mode == 3
+
+    return {
+        "version": version,
+        "bitrate_index": bitrate_index,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channel_mode": channel_mode,
+        "protected": not (b1 & 0x01),
+        "samples": 1152 if mpeg1 else 576,
+        "length": (144 if mpeg1 else 72) * bitrate // sample_rate + padding,
+        "side_info": (17 if mono else 32) if mpeg1 else (9 if mono else 17),
+    }
+
+
+def skip_id3v2(data):
+    """先頭のID3v2タグの長さを返す"""
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = 0
+        for b in data[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def is_info_frame(data, offset, header):
+    """Xing/Info/VBRI のヘッダーフレーム（音声を含まない）かどうか"""
+    start = offset + 4 + (2 if header["protected"] else 0) + header["side_info"]
+    return data[start:start + 4] in (b"Xing", b"Info") or data[offset + 36:offset + 40] == b"VBRI"
+
+
+def split_frames(data):
+    """MP3のバイト列を音声フレームに分け、(ヘッダー, フレーム) のリストを返す"""
+    offset = skip_id3v2(data)
+    end = len(data)
+    if end - offset >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    frames = []
+    while offset < end:
+        header = parse_header(data, offset)
+        if header is None:
+            if frames:
+                # 末尾のゴミは無視する
+                break
+            # 先頭のフレームが見つかるまで読み進める
+            offset += 1
+            continue
+        if offset + header["length"] > end:
+            break
+        if not is_info_frame(data, offset, header):
+            if frames and not same_stream(frames[0][0], header):
+                raise MP3FormatError("フレームごとに形式が異なります")
+            frames.append((header, data[offset:offset + header["length"]]))
+        offset += header["length"]
+
+    if not frames:
+        raise MP3FormatError("MP3のフレームが見つかりません")
+    return frames
+
+
+def same_stream(a, b):
+    """2つのフレームが1つのストリームに並べられる形式かどうか"""
+    keys = ("version", "sample_rate", "channel_mode")
+    return all(a[key] == b[key] for key in keys)
+
+
+def build_frame(header, template, bitrate_index, payload=b""):
+    """template のヘッダーを元に、指定したビットレートのフレームを作る
+
+    CRCなし・パディングなしにして、サイド情報とメインデータを0で埋める。
+    サイド情報とメインデータがすべて0のフレームは無音としてデコードされる。
+    """
+    mpeg1 = header["samples"] == 1152
+    bitrate = BITRATES["mpeg1" if mpeg1 else "mpeg2"][bitrate_index] * 1000
+    length = (144 if mpeg1 else 72) * bitrate // header["sample_rate"]
+    b1 = template[1] | 0x01
+    b2 = (bitrate_index << 4) | (template[2] & 0x0D)
+    body = bytes(header["side_info"]) + payload
+    if 4 + len(body) > length:
+        return None
+    return bytes([0xFF, b1, b2, template[3]]) + body + bytes(length - 4 - len(body))
+
+
+def xing_frame(header, template, bitrate_index, frame_count, byte_count, cbr):
+    """全体のフレーム数とバイト数を書いた Xing/Info フレームを作る"""
+    payload = (b"Info" if cbr else b"Xing") + struct.pack(">III", 0x03, frame_count, byte_count)
+    # 収まるビットレートまで上げる
+    for index in range(bitrate_index, 15):
+        frame = build_frame(header, template, index, payload)
+        if frame is not None:
+            return frame
+    raise MP3FormatError("Xingフレームを作れません")
+
+
+def concat_mp3(contents, gap_seconds):
+    """MP3のバイト列をデコードせずに、間に無音を入れて結合する
+
+    すべてのMP3が同じMPEGバージョン・サンプリングレート・チャンネルでなければ
+    MP3FormatError を送出する。すべてのフレームが同じビットレートなら
+    出力もCBRになる。
+    """
+    segments = [split_frames(content) for content in contents if content]
+    if not segments:
+        raise MP3FormatError("結合する音声がありません")
+
+    first, template = segments[0][0]
+    for frames in segments[1:]:
+        if not same_stream(first, frames[0][0]):
+            raise MP3FormatError("セリフごとに音声の形式が異なります")
+
+    # すべて同じビットレートなら無音も同じビットレートにしてCBRを保つ
+    bitrate_indexes = {header["bitrate_index"] for frames in segments for header, _ in frames}
+    cbr = len(bitrate_indexes) == 1
+    silence_index = first["bitrate_index"] if cbr else min(bitrate_indexes)
+    silence = build_frame(first, template, silence_index)
+    silence_count = round(gap_seconds * first["sample_rate"] / first["samples"])
+
+    joined = []
+    for i, frames in enumerate(segments):
+        if i:
+            joined.extend([silence] * silence_count)
+        joined.extend(frame for _, frame in frames)
+
+    body = b"".join(joined)
+    header_frame = xing_frame(first, template, silence_index, len(joined), 0, cbr)
+    # バイト数はXingフレーム自身を含む
+    header_frame = xing_frame(
+        first, template, silence_index, len(joined), len(header_frame) + len(body), cbr
+    )
+    return header_frame + body
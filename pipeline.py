@@ -0,0 +1,239 @@
+"""Streamlit に依存しないポッドキャスト生成の処理
+
+アプリ（app.py）とバッチ処理（batch.py）の両方から使う。
+"""
+import time
+
+from cost_ledger import speech_cost_usd
+from metrics import METRICS
+from script_text import convert_to_ssml
+from summarizer import get_encoding
+from tts import TTS_MAX_INPUT_CHARS, TTS_MAX_WORKERS, TTS_MODEL, synthesize_segments, write_episode
+
+# 台本の生成に使うモデル
+SCRIPT_MODEL = "gpt-4"
+
+# 台本の最大トークン数
+SCRIPT_MAX_TOKENS = 4000
+
+
+def build_script_prompt(article_info, summary):
+    """要約からポッドキャスト台本を生成するプロンプトを作る"""
+    return (
+        "以下の要約された記事内容を基に、テーマや結論がしっかり伝わるように、"
+        "聞き手が理解しやすい長さ（最大20分、ベストな長さはお任せします）で、"
+        "日本語のポッドキャスト台本にしてください。\n\n"
+        "【台本の形式】\n"
+        "- プロフェッショナルなホストA（先生役）と、初学者のホストB（生徒役）による対話形式\n"
+        "- 各発言の前に「A:」「B:」をつけて、誰の発言かを明確にする\n"
+        "- 会話の間は「...」ではなく「、」や「。」を使って自然な間を表現\n"
+        "- 最後に記事の重要なポイントをまとめて締めくくってください\n"
+        "- BGMや効果音などの演出指示は含めない\n\n"
+        "【台本の内容について】\n"
+        "- 専門用語が出てきたら、必ず身近な例を使って説明してください\n"
+        "- 「なぜそうなるのか」という理由や背景を丁寧に説明してください\n"
+        "- 抽象的な概念は具体的な例を使って説明してください\n"
+        "- 重要なポイントは繰り返し説明してください\n"
+        "- 生徒役（B）は適度に質問や疑問を投げかけ、理解を深めるようにしてください\n"
+        "- 先生役（A）は生徒の理解度を確認しながら、必要に応じて補足説明をしてください\n\n"
+        "【日本語の表現について】\n"
+        "- 自然な日本語のイントネーションになるように、適切な句読点を使用してください\n"
+        "- 重要な部分は強調するように、文の構造を工夫してください\n"
+        "- 会話の流れを考慮して、適切な間を取るようにしてください\n"
+        "- 文末表現は「です・ます」調を基本とし、必要に応じて「だ・である」調も使用してください\n\n"
+        "【画像の扱いについて】\n"
+        "- 画像の内容を単に説明するのではなく、その意図や伝えたいメッセージを会話の中で自然に伝えてください\n"
+        "- 例えば、象とりんごの大きさを比較する画像がある場合、\n"
+        "  ×「象とりんごの画像があります」\n"
+        "  ○「りんごは象と比較すると何倍も小さいです」\n"
+        "  のように、画像の意図を会話の中で自然に説明してください\n"
+        "- 画像の視覚的な要素（色、形、配置など）が重要な場合は、その効果や意図を説明してください\n"
+        "- 複数の画像がある場合は、それらの関連性やストーリー性を活かして説明してください\n\n"
+        "【記事タイトル】\n"
+        f"{article_info['title']}\n\n"
+        "【要約された内容】\n"
+        f"{summary}\n\n"
+        "【ポッドキャスト台本】"
+    )
+
+
+def stream_script(client, prompt, model=SCRIPT_MODEL, usage=None):
+    """台本をストリーミングで生成し、届いたテキストの断片を順に返す
+
+    届いた断片の数と最初の断片までの時間を計測する。
+    usage にリストを渡すと、受信が終わった時点（途中で失敗したときも）でトークン数を
+    {'model', 'prompt_tokens', 'completion_tokens', 'source'} として追加する。
+    最後のチャンクで usage を返すように要求し、返ってこなければ手元で数える。
+    """
+    with METRICS.timer("llm_completion", stage="script", model=model) as fields:
+        start = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=SCRIPT_MAX_TOKENS,
+            temperature=0.8,
+            stream=True,
+            # このバージョンの SDK には stream_options の引数がないのでリクエストに直接追加する
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+        fields["chunks"] = 0
+        fields["chars"] = 0
+        parts = []
+        reported = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    # SDK のモデルにない項目なので、dict のまま届く場合もある
+                    reported = dict(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not fields["chunks"]:
+                        METRICS.observe("llm_first_chunk_seconds", time.perf_counter() - start,
+                                        stage="script", model=model)
+                    fields["chunks"] += 1
+                    fields["chars"] += len(chunk.choices[0].delta.content)
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            # 受信が途中で失敗・中断しても、それまでに生成された分は課金されるので記録する
+            if reported:
+                tokens = {
+                    'prompt_tokens': reported["prompt_tokens"],
+                    'completion_tokens': reported["completion_tokens"],
+                    'source': 'usage'
+                }
+            else:
+                encoding = get_encoding(model)
+                tokens = {
+                    'prompt_tokens': len(encoding.encode(prompt)),
+                    'completion_tokens': len(encoding.encode("".join(parts))),
+                    'source': 'estimate'
+                }
+            fields["prompt_tokens"] = tokens['prompt_tokens']
+            fields["completion_tokens"] = tokens['completion_tokens']
+            if usage is not None:
+                usage.append({'model': model, **tokens})
+
+
+def tts_cost_usd(chars, model=TTS_MODEL):
+    """音声生成の料金（USD）を計算する"""
+    return speech_cost_usd(model, chars)
+
+
+def plan_requests(dialogues, max_chars=TTS_MAX_INPUT_CHARS):
+    """セリフを音声生成のリクエストにまとめる
+
+    同じ話者の連続したセリフは、変換後のテキストが max_chars 以下に収まる限り
+    改行でつないで1つのリクエストにする（話者が替わるところには従来どおり
+    無音の間が入る）。max_chars が None なら1セリフ1リクエストにする。
+    イテレータを渡すと、話者が替わった時点でそれまでのリクエストを返す。
+    各リクエストは {'speaker', 'text'（変換後）, 'chars'（送信する文字数＝課金の対象）,
+    'first'（最初のセリフの番号）, 'lines'（セリフ数）}。
+    """
+    request = None
+    for i, dialogue in enumerate(dialogues):
+        text = convert_to_ssml(dialogue['text'])
+        if (request and max_chars and request['speaker'] == dialogue['speaker']
+                and len(request['text']) + 1 + len(text) <= max_chars):
+            request['text'] += "\n" + text
+            request['chars'] += 1 + len(text)
+            request['lines'] += 1
+            continue
+        if request:
+            yield request
+        request = {
+            'speaker': dialogue['speaker'],
+            'text': text,
+            'chars': len(text),
+            'first': i,
+            'lines': 1
+        }
+    if request:
+        yield request
+
+
+def render_episode(client, dialogues, voices, store, cache=None, max_workers=TTS_MAX_WORKERS,
+                   normalize_mode="peak", on_progress=None, cache_stats=None, executor=None,
+                   max_request_chars=TTS_MAX_INPUT_CHARS, on_audio=None, on_billed=None):
+    """セリフのリストまたはイテレータから音声を生成し、エピソードとして保存する
+
+    voices は {'teacher': 声, 'student': 声}。イテレータを渡すと、セリフが届くたびに
+    すぐ音声化を始める。on_progress には (完了数, それまでに届いたセリフ数) が渡される。
+    executor を渡すと、セリフの音声化をそのスレッドプールで行う（複数のエピソードで
+    TTSの同時実行数を共有するとき）。
+    同じ話者の連続したセリフは max_request_chars 文字までまとめて1回で音声化する
+    （plan_requests を参照）。
+    on_audio を渡すと、リクエストの音声ができるたびに (リクエストの番号, MP3または
+    None) で呼び出す（完成した部分から再生するとき。progressive.SegmentPlaylist を参照）。
+    on_billed を渡すと、APIで音声を生成したリクエストが終わるたびにその文字数で
+    呼び出す（結合や台本の生成が後で失敗しても、課金されたリクエストを記録できる）。
+    戻り値は (保存したファイルのパス, 音声生成のコスト, エラーの辞書)。
+    エラーの辞書のキーは失敗したリクエストの最初のセリフの番号。
+    音声が1つもできなければパスは None。
+    """
+    if cache_stats is None:
+        cache_stats = {}
+    spoken = []
+    spoken_lines = 0
+
+    # セリフをリクエストにまとめ、話者に応じた声を割り当てる（文字列型であることを確認）
+    def segments():
+        nonlocal spoken_lines
+        for request in plan_requests(dialogues, max_request_chars):
+            spoken.append(request)
+            spoken_lines += request['lines']
+            yield {
+                'text': request['text'],
+                'voice': str(voices[request['speaker']])
+            }
+
+    # 完了したセリフ数を数えて進捗を通知する
+    # （APIで生成したリクエストの文字数は、終わった時点で課金分として記録する）
+    completed = 0
+    billed_requests = []
+
+    def on_segment(i, content):
+        nonlocal completed
+        completed += spoken[i]['lines']
+        if content is not None and i not in cache_stats['cached']:
+            billed_requests.append(spoken[i]['chars'])
+            if on_billed:
+                on_billed(spoken[i]['chars'])
+        if on_audio:
+            on_audio(i, content)
+        if on_progress:
+            on_progress(completed, spoken_lines)
+
+    # 各セリフの音声を並列に生成（失敗したセリフはセリフ単位でリトライされる）
+    with METRICS.timer("synthesize") as fields:
+        contents, errors = synthesize_segments(
+            client, segments(), max_workers=max_workers, on_segment=on_segment,
+            cache=cache, stats=cache_stats, executor=executor
+        )
+        fields["lines"] = spoken_lines
+        fields["requests"] = len(spoken)
+        fields["cache_hits"] = len(cache_stats.get('cached', ()))
+        fields["failed"] = len(errors)
+
+    # 各セリフの音声を台本の順番で結合して保存
+    # （形式が揃っていればデコードせずにMP3のフレームを連結する）
+    # （リクエストごとの一時ファイルに書き出してから、内容のハッシュ名で確定する）
+    temp_file = store.temp_path()
+    try:
+        mode = write_episode(contents, temp_file, normalize_mode=normalize_mode)
+    except Exception:
+        store.discard(temp_file)
+        raise
+    output_file = store.commit(temp_file) if mode else None
+
+    # 音声生成のコストを計算（APIで生成したセリフのみ）
+    cached = cache_stats.get('cached', set())
+    total_chars = sum(billed_requests)
+
+    # キャッシュで節約できたコスト
+    cache_stats['saved_usd'] = tts_cost_usd(sum(spoken[i]['chars'] for i in cached))
+    cache_stats['billed_chars'] = total_chars
+    cache_stats['billed_requests'] = billed_requests
+    cache_stats['failed'] = len(errors)
+
+    errors = {spoken[i]['first']: e for i, e in errors.items()}
+    return output_file, tts_cost_usd(total_chars), errors
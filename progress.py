@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+
+# ステージごとの実測時間を保存するファイルのパス
+STAGE_TIMINGS_FILE = "stage_timings.json"
+
+# ステージごとに保持する実測値の件数
+MAX_TIMING_SAMPLES = 20
+
+# 実測値がないときに使う単位あたりの所要時間（秒）
+# summary / script: 記事1文字あたり、tts: セリフ1つあたり
+DEFAULT_SECONDS_PER_UNIT = {
+    "summary": 0.004,
+    "script": 0.02,
+    "tts": 2.5,
+}
+
+# 実測値がないときに想定する単位数
+DEFAULT_UNITS = {
+    "summary": 3000,
+    "script": 3000,
+    "tts": 100,
+}
+
+# 実測時間のファイルの読み書きをセッション（スレッド）間で排他する
+_timings_lock = threading.Lock()
+
+# 単位数に依存しない固定の待ち時間（秒）
+DEFAULT_BASE_SECONDS = {
+    "summary": 5.0,
+    "script": 10.0,
+    "tts": 2.0,
+}
+
+
+def load_stage_timings(path=STAGE_TIMINGS_FILE):
+    """ステージの実測時間をファイルから読み込む"""
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    return {}
+
+
+def record_stage_timing(stage, seconds, units, path=STAGE_TIMINGS_FILE):
+    """ステージの実測時間を記録する（古い実測値から捨てる）"""
+    with _timings_lock:
+        timings = load_stage_timings(path)
+        samples = timings.setdefault(stage, [])
+        samples.append({"seconds": float(seconds), "units": max(int(units), 1)})
+        timings[stage] = samples[-MAX_TIMING_SAMPLES:]
+
+        # 書き込み途中のファイルを読まれないように一時ファイルから置き換える
+        # （一時ファイルの名前はスレッドごとに変える）
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(timings, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+    return timings
+
+
+def estimate_stage_seconds(stage, units=None, timings=None):
+    """実測値から単位数に応じたステージの所要時間（秒）を見積もる
+
+    units を省略すると、過去の実測値の平均的な単位数で見積もる。
+    """
+    if timings is None:
+        timings = load_stage_timings()
+    samples = timings.get(stage, [])
+    if units is None:
+        if samples:
+            units = sum(s["units"] for s in samples) / len(samples)
+        else:
+            units = DEFAULT_UNITS[stage]
+    units = max(int(units), 1)
+
+    if not samples:
+        return DEFAULT_BASE_SECONDS[stage] + DEFAULT_SECONDS_PER_UNIT[stage] * units
+
+    # 単位あたりの時間を、直近の実測値全体の合計から求める
+    total_seconds = sum(s["seconds"] for s in samples)
+    total_units = sum(s["units"] for s in samples)
+    return total_seconds / total_units * units
+
+
+def format_remaining(seconds):
+    """残り秒数を「X分Y秒」の形式にする"""
+    seconds = max(int(round(seconds)), 0)
+    return f"{seconds // 60}分{seconds % 60}秒"
+
+
+class StageClock:
+    """実行中ステージの経過時間と残り時間を管理する"""
+
+    def __init__(self, stage, units, timings=None):
+        self.stage = stage
+        self.units = max(int(units), 1)
+        self.estimate = estimate_stage_seconds(stage, self.units, timings)
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self, done=None):
+        """残り時間を返す（done を渡すと実際の進み具合から計算する）"""
+        elapsed = self.elapsed()
+        if done:
+            # 完了した単位の実測ペースで残りを見積もる
+            return elapsed / done * (self.units - done)
+        return max(self.estimate - elapsed, 0.0)
+
+    def fraction(self, done=None):
+        """ステージ内の進捗率（0〜1）を返す"""
+        if done is not None:
+            return min(done / self.units, 1.0)
+        return min(self.elapsed() / self.estimate, 0.99) if self.estimate else 0.0
+
+    def finish(self, path=STAGE_TIMINGS_FILE, units=None):
+        """ステージの実測時間を記録する
+
+        units を渡すと、実際に処理した単位数（キャッシュから取得した分を除くなど）で記録する。
+        記録に失敗しても例外は出さない（見積もりのための記録で生成を止めないため）。
+        """
+        try:
+            return record_stage_timing(self.stage, self.elapsed(), units or self.units, path)
+        except Exception:
+            return None
@@ -0,0 +1,67 @@
+"""音声化が終わった部分から順に再生できるようにする
+
+セリフの音声は並列に生成されるので、完成する順番は台本の順番と一致しない。
+SegmentPlaylist は先頭から途切れずに揃ったセリフを「パート」として
+まとめて渡すので、エピソード全体の完成を待たずに最初のパートから再生できる。
+"""
+from mp3_frames import MP3FormatError, concat_mp3
+from tts import GAP_SECONDS
+
+# 最初のパートのセリフ数（早く再生を始められるように少なくする）
+FIRST_PART_SEGMENTS = 2
+
+# パートのセリフ数の上限（パートごとに倍に増やしていく）
+MAX_PART_SEGMENTS = 16
+
+
+class SegmentPlaylist:
+    """完成したセリフの音声を台本の順番に並べ、パートごとに on_part に渡す
+
+    on_part には (パートの番号, MP3のバイト列) が渡される。パートのセリフ数は
+    FIRST_PART_SEGMENTS から始めて MAX_PART_SEGMENTS まで倍に増やす
+    （再生できるまでの時間を短くしつつ、パートの数を抑える）。
+    """
+
+    def __init__(self, on_part, first_part=FIRST_PART_SEGMENTS, max_part=MAX_PART_SEGMENTS,
+                 gap_seconds=GAP_SECONDS):
+        self.on_part = on_part
+        self.part_size = first_part
+        self.max_part = max_part
+        self.gap_seconds = gap_seconds
+        # 番号 → 音声（失敗したセリフは None）
+        self.finished = {}
+        # 次にパートに入れるセリフの番号と、パートに入れる音声
+        self.next_index = 0
+        self.ready = []
+        self.parts = 0
+
+    def add(self, i, content):
+        """セリフ i の音声が完成した（失敗したときは None）"""
+        self.finished[i] = content
+        while self.next_index in self.finished:
+            content = self.finished.pop(self.next_index)
+            self.next_index += 1
+            if content is not None:
+                self.ready.append(content)
+            if len(self.ready) >= self.part_size:
+                self._emit()
+                self.part_size = min(self.part_size * 2, self.max_part)
+
+    def finish(self):
+        """残りのセリフを最後のパートとして渡す"""
+        if self.ready:
+            self._emit()
+
+    def _emit(self):
+        try:
+            data = concat_mp3(self.ready, self.gap_seconds)
+        except MP3FormatError:
+            # 形式が揃っていないパートはセリフごとに渡す
+            for content in self.ready:
+                self.on_part(self.parts, content)
+                self.parts += 1
+            self.ready = []
+            return
+        self.on_part(self.parts, data)
+        self.parts += 1
+        self.ready = []
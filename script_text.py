@@ -0,0 +1,133 @@
+"""台本テキストの解析と音声生成用の変換
+
+どの処理も正規表現で1回走査するだけなので、台本の長さに比例した時間で済む。
+"""
+import re
+from xml.sax.saxutils import escape
+
+# 台本のセリフの行（「A:」「B:」で始まる行。全角のコロンも受け付ける）
+DIALOGUE_LINE = re.compile(r"\s*([AB])\s*[:：](.*)")
+
+# 台本全体からセリフの行を探す（行ごとに DIALOGUE_LINE と同じ規則）
+DIALOGUE_LINES = re.compile(r"^[^\S\n]*([AB])[^\S\n]*[:：](.*)", re.MULTILINE)
+
+# 話者の記号と役割
+SPEAKERS = {'A': 'teacher', 'B': 'student'}
+
+# 音声生成用のテキストの字句
+#   quote: 「…」（閉じていなければ行末まで）
+#   end:   文末の記号（。？！）
+#   close: 対応する「 がない 」
+#   text:  それ以外の文字の並び
+TOKEN = re.compile(
+    r"(?P<quote>「[^」]*(?:」|$))"
+    r"|(?P<end>[。？！]+)"
+    r"|(?P<close>」)"
+    r"|(?P<text>[^「」。？！]+)"
+)
+
+# SSML で入れる間の長さ（ミリ秒）
+QUOTE_PAUSE_MS = 200
+SENTENCE_PAUSE_MS = 400
+
+
+def parse_dialogue_line(line):
+    """台本の1行を解析し、A（先生）かB（生徒）のセリフなら辞書を返す
+
+    先頭の話者の記号だけを取り除く（セリフの中の「A:」などはそのまま残す）。
+    セリフが空の行は None を返す。
+    """
+    match = DIALOGUE_LINE.match(line)
+    text = match.group(2).strip() if match else ""
+    if not text:
+        return None
+    return {
+        'speaker': SPEAKERS[match.group(1)],
+        'text': text
+    }
+
+
+def split_script_by_speaker(script):
+    """台本をA（先生）とB（生徒）のパートに分割"""
+    dialogues = []
+    for speaker, text in DIALOGUE_LINES.findall(script):
+        text = text.strip()
+        if text:
+            dialogues.append({'speaker': SPEAKERS[speaker], 'text': text})
+    return dialogues
+
+
+def iter_dialogues(chunks):
+    """ストリーミングで届く台本の断片から、完成したセリフを順に返す
+
+    split_script_by_speaker と同じ規則で、改行が届いた時点でその行を解析する。
+    改行を含まない断片は結合せずにためておくので、長い行でも線形時間で済む。
+    """
+    pending = []
+    for chunk in chunks:
+        if '\n' not in chunk:
+            pending.append(chunk)
+            continue
+        first, *lines, rest = chunk.split('\n')
+        pending.append(first)
+        for line in ["".join(pending), *lines]:
+            dialogue = parse_dialogue_line(line)
+            if dialogue:
+                yield dialogue
+        pending = [rest]
+
+    # 最後の行は改行がなくてもセリフとして扱う
+    dialogue = parse_dialogue_line("".join(pending))
+    if dialogue:
+        yield dialogue
+
+
+def tokenize_sentences(text):
+    """テキストを文ごとの字句のリストに分ける
+
+    戻り値は [[(種類, 文字列), ...], ...]。「…」の中の文末記号では文を区切らない。
+    """
+    sentences = []
+    current = []
+    for match in TOKEN.finditer(text):
+        current.append((match.lastgroup, match.group()))
+        if match.lastgroup == "end":
+            sentences.append(current)
+            current = []
+    if current:
+        sentences.append(current)
+    return sentences
+
+
+def convert_to_ssml(text, ssml=False):
+    """テキストを音声生成用に変換する
+
+    文ごとに区切り、「…」の前（対応しない 」 の後）に間を入れ、文末の記号が
+    ない文には「。」を補う。ssml が False のときは間を「、」で表す
+    （OpenAI の音声生成はSSMLのタグを解釈しないため）。True のときは
+    <break> で間を入れた SSML を返す。
+    """
+    pause = f'<break time="{QUOTE_PAUSE_MS}ms"/>' if ssml else "、"
+    processed = []
+    for tokens in tokenize_sentences(text):
+        parts = []
+        for kind, value in tokens:
+            if ssml:
+                value = escape(value)
+            if kind == "quote":
+                parts.append(pause + value)
+            elif kind == "close":
+                parts.append(value + pause)
+            else:
+                parts.append(value)
+        sentence = "".join(parts).strip()
+        if not sentence:
+            continue
+        if tokens[-1][0] != "end":
+            sentence += "。"
+        processed.append(sentence)
+
+    if ssml:
+        sentence_pause = f'<break time="{SENTENCE_PAUSE_MS}ms"/>'
+        return "<speak>" + sentence_pause.join(processed) + "</speak>"
+    return "".join(processed)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# 音声キャッシュの保存先
+SEGMENT_CACHE_DIR = "tts_cache"
+
+# キャッシュの容量の上限（バイト）
+SEGMENT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# インデックスファイルの名前
+INDEX_FILE = "index.json"
+
+# 前回の flush 以降の追加・削除を追記するログファイルの名前
+JOURNAL_FILE = "index.log"
+
+
+def segment_key(model, voice, text):
+    """TTSのモデル・声・変換後のテキストからキャッシュのキーを作る"""
+    payload = json.dumps([model, voice, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SegmentCache:
+    """合成済みのセリフ音声（MP3）をディスクに保存するLRUキャッシュ
+
+    インデックス（キー → バイト数）を使用順に並べてメモリに持ち、
+    検索はインデックスだけで行う。容量を超えたら古いものから削除する。
+    追加と削除はログファイルに1行ずつ追記するだけにして、インデックス全体の
+    書き直しは flush（エピソードごとに1回）で行う。
+    インデックスはプロセスのメモリにあるので、1つのディレクトリは1つのプロセス
+    だけで使う（アプリとバッチは別のディレクトリを使う）。
+    """
+
+    def __init__(self, directory=SEGMENT_CACHE_DIR, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._load_index()
+        self.total_bytes = sum(self.index.values())
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _journal_path(self):
+        return os.path.join(self.directory, JOURNAL_FILE)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _load_index(self):
+        """インデックスを読み込み、ログの追加・削除を反映する（壊れていれば空から始める）"""
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = OrderedDict(json.load(f))
+        except (OSError, ValueError):
+            index = OrderedDict()
+        try:
+            with open(self._journal_path(), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key, size = json.loads(line)
+                    except ValueError:
+                        # 書き込みの途中で止まった最後の行は無視する
+                        continue
+                    index.pop(key, None)
+                    if size is not None:
+                        index[key] = size
+        except OSError:
+            pass
+        return index
+
+    def _append_journal(self, records):
+        """追加（キー, バイト数）と削除（キー, None）をログに追記する"""
+        with open(self._journal_path(), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def _save_index(self):
+        temp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self.index.items()), f)
+        os.replace(temp_path, self._index_path())
+        # インデックスに反映したのでログは空にする
+        open(self._journal_path(), "w").close()
+
+    def get(self, key):
+        """キャッシュされた音声を返す（なければ None）"""
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            # ファイルが消えていればインデックスからも外す
+            with self.lock:
+                self.total_bytes -= self.index.pop(key, 0)
+            return None
+
+    def put(self, key, content):
+        """音声をキャッシュに保存し、容量を超えた分を古い順に削除する"""
+        temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, self._path(key))
+
+        with self.lock:
+            self.total_bytes -= self.index.pop(key, 0)
+            self.index[key] = len(content)
+            self.total_bytes += len(content)
+            records = [(key, len(content))]
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, size = self.index.popitem(last=False)
+                self.total_bytes -= size
+                records.append((old_key, None))
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+            self._append_journal(records)
+
+    def flush(self):
+        """使用順の変化とログの内容をインデックスファイルに反映する"""
+        with self.lock:
+            self._save_index()
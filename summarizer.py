@@ -0,0 +1,246 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from metrics import METRICS
+
+# 要約に使うモデル
+SUMMARY_MODEL = "gpt-4"
+
+# 本文がこのトークン数以下なら分割せずに1回で要約する
+SINGLE_PASS_TOKENS = 5000
+
+# 分割するときの1チャンクあたりのトークン数
+CHUNK_TOKENS = 2500
+
+# 最後にまとめる（reduce）ときに、部分ごとの要約の合計がこのトークン数を超えたら
+# 先にいくつかずつ統合して減らす（モデルのコンテキスト長に収めるため）
+REDUCE_INPUT_TOKENS = 5000
+
+# チャンクの要約を同時に実行する数
+SUMMARY_MAX_WORKERS = 4
+
+# プロンプトに含める画像の最大数
+MAX_IMAGES = 10
+
+# 文の区切り（句点・感嘆符・疑問符・改行の直後）
+SENTENCE_END = re.compile(r"(?<=[。！？!?\n])")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=SUMMARY_MODEL):
+    """モデルのトークナイザーを返す（プロセスごとに1回だけ読み込む）"""
+    # tiktoken はトークン数を数えるときまで読み込まない
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
+
+def dedupe_images(images, max_images=MAX_IMAGES):
+    """画像URLの重複（クエリ文字列違いを含む）を除き、最大数までに絞る"""
+    seen = set()
+    unique = []
+    # newspaper は画像をsetで返すので、プロンプトが毎回同じになるように並べる
+    for url in sorted(images or []):
+        parts = urlsplit(url)
+        key = (parts.netloc.lower(), parts.path)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(url)
+    return unique[:max_images]
+
+
+def split_sentences(text):
+    """本文を文単位に分割する"""
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, encoding=None):
+    """本文を文の区切りで、1つあたり max_tokens 以下のチャンクに分ける"""
+    encoding = encoding or get_encoding()
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for sentence in split_sentences(text):
+        tokens = len(encoding.encode(sentence))
+
+        # 1文だけで上限を超える場合はトークン単位で切る
+        if tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            ids = encoding.encode(sentence)
+            for start in range(0, len(ids), max_tokens):
+                chunks.append(encoding.decode(ids[start:start + max_tokens]))
+            continue
+
+        if current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def format_images(images):
+    """画像URLの一覧をプロンプト用の文字列にする"""
+    if not images:
+        return ""
+    lines = ["記事内の画像:"]
+    lines += [f"画像{i}: {img_url}" for i, img_url in enumerate(images, 1)]
+    return "\n".join(lines) + "\n\n"
+
+
+def complete(client, prompt, model=SUMMARY_MODEL, usage=None):
+    """プロンプトを1回実行して応答を返す
+
+    usage にリストを渡すと、APIの応答のトークン数を
+    {'model', 'prompt_tokens', 'completion_tokens', 'source'} として追加する
+    （応答に usage がなければ手元で数える）。
+    """
+    with METRICS.timer("llm_completion", stage="summary", model=model) as fields:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.7,
+        )
+        content = response.choices[0].message.content
+        if response.usage:
+            tokens = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens,
+                'source': 'usage'
+            }
+        else:
+            encoding = get_encoding(model)
+            tokens = {
+                'prompt_tokens': len(encoding.encode(prompt)),
+                'completion_tokens': len(encoding.encode(content)),
+                'source': 'estimate'
+            }
+        fields["prompt_tokens"] = tokens['prompt_tokens']
+        fields["completion_tokens"] = tokens['completion_tokens']
+    if usage is not None:
+        usage.append({'model': model, **tokens})
+    return content.strip()
+
+
+def summarize_single(client, article_info, images, model=SUMMARY_MODEL, usage=None):
+    """記事全体を1回のリクエストで要約する"""
+    # 記事の本文と画像情報を組み合わせる
+    article_content = f"記事タイトル: {article_info['title']}\n\n"
+    article_content += format_images(images)
+    article_content += f"記事本文:\n{article_info['text']}"
+
+    prompt = (
+        "以下の記事（本文と画像を含む）の内容を、重要なポイントを逃さないように要約してください。\n"
+        "特に画像については、その意図や伝えたいメッセージを分析して要約してください。\n\n"
+        "【記事内容】\n"
+        f"{article_content}\n\n"
+        "【要約】"
+    )
+    return complete(client, prompt, model, usage)
+
+
+def summarize_chunk(client, title, chunk, index, total, model=SUMMARY_MODEL, usage=None):
+    """長い記事の一部分を要約する（map）"""
+    prompt = (
+        f"以下は記事「{title}」の本文を分割したものの一部（{index}/{total}）です。\n"
+        "この部分に含まれる重要なポイント、数値、固有名詞を逃さないように要約してください。\n\n"
+        "【本文の一部】\n"
+        f"{chunk}\n\n"
+        "【要約】"
+    )
+    return complete(client, prompt, model, usage)
+
+
+def group_by_tokens(texts, max_tokens, encoding):
+    """テキストを順番のまま、合計が max_tokens 以下のグループに分ける
+
+    1つで上限を超えるテキストはそれだけのグループにする。
+    """
+    groups = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = len(encoding.encode(text))
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def merge_summaries(client, title, summaries, model=SUMMARY_MODEL, usage=None):
+    """連続した部分の要約をいくつかまとめて1つの要約にする（reduce の前の中間段階）"""
+    parts = "\n\n".join(f"（{i}）{summary}" for i, summary in enumerate(summaries, 1))
+    prompt = (
+        f"以下は記事「{title}」の本文を分割して要約したもののうち、連続した部分です。\n"
+        "これらを1つに統合し、重要なポイント、数値、固有名詞を逃さないように要約してください。\n\n"
+        "【部分ごとの要約】\n"
+        f"{parts}\n\n"
+        "【要約】"
+    )
+    return complete(client, prompt, model, usage)
+
+
+def reduce_summaries(client, title, summaries, images, model=SUMMARY_MODEL, usage=None):
+    """部分ごとの要約をまとめて記事全体の要約にする（reduce）"""
+    parts = "\n\n".join(f"（{i}）{summary}" for i, summary in enumerate(summaries, 1))
+    prompt = (
+        "以下は長い記事を分割して要約したものです。これらを統合し、記事全体の内容を、"
+        "重要なポイントを逃さないように要約してください。\n"
+        "特に画像については、その意図や伝えたいメッセージを分析して要約してください。\n\n"
+        f"記事タイトル: {title}\n\n"
+        f"{format_images(images)}"
+        "【部分ごとの要約】\n"
+        f"{parts}\n\n"
+        "【要約】"
+    )
+    return complete(client, prompt, model, usage)
+
+
+def summarize_article(client, article_info, model=SUMMARY_MODEL, single_pass_tokens=SINGLE_PASS_TOKENS,
+                      chunk_tokens=CHUNK_TOKENS, max_workers=SUMMARY_MAX_WORKERS, max_images=MAX_IMAGES,
+                      usage=None, reduce_tokens=REDUCE_INPUT_TOKENS):
+    """記事を要約する
+
+    本文が single_pass_tokens 以下なら1回で要約する。長い記事は文の区切りで
+    chunk_tokens ごとのチャンクに分け、チャンクごとの要約を並列に実行してから
+    最後に1回でまとめる（map-reduce）。部分ごとの要約の合計が reduce_tokens を
+    超えるときは、収まるまで連続した要約を reduce_tokens ずつ統合してから最後にまとめる。
+    usage にリストを渡すと、すべてのリクエストのトークン数を追加する（complete を参照）。
+    """
+    images = dedupe_images(article_info['images'], max_images)
+    encoding = get_encoding(model)
+    if len(encoding.encode(article_info['text'])) <= single_pass_tokens:
+        return summarize_single(client, article_info, images, model, usage)
+
+    chunks = chunk_text(article_info['text'], chunk_tokens, encoding)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        summaries = list(executor.map(
+            lambda args: summarize_chunk(client, article_info['title'], args[1], args[0], len(chunks), model, usage),
+            enumerate(chunks, 1)
+        ))
+
+        # まとめる前に、要約の合計がコンテキストに収まるまで段階的に統合する
+        while len(summaries) > 1 and len(encoding.encode("".join(summaries))) > reduce_tokens:
+            groups = group_by_tokens(summaries, reduce_tokens, encoding)
+            if len(groups) == len(summaries):
+                # どの要約も1つで上限に近く、これ以上まとめられない
+                break
+            summaries = list(executor.map(
+                lambda group: group[0] if len(group) == 1
+                else merge_summaries(client, article_info['title'], group, model, usage),
+                groups
+            ))
+    return reduce_summaries(client, article_info['title'], summaries, images, model, usage)
@@ -0,0 +1,250 @@
+import io
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# librosa・numpy・openai・loudness（scipy）は読み込みに時間がかかるので、
+# アプリの起動を遅くしないように使う関数の中で import する
+from metrics import METRICS
+from mp3_frames import MP3FormatError, concat_mp3
+from segment_cache import segment_key
+
+# 同時に実行するTTSリクエスト数の既定値
+TTS_MAX_WORKERS = 4
+
+# 1セリフあたりの最大リトライ回数
+TTS_MAX_RETRIES = 5
+
+# リトライ間隔の基準（秒）。attempt 回目は基準 * 2**attempt 秒待つ
+TTS_BACKOFF_BASE = 1.0
+
+# リトライ間隔の上限（秒）
+TTS_BACKOFF_MAX = 30.0
+
+# TTSのモデル
+TTS_MODEL = "tts-1"
+
+# 1リクエストで送れるテキストの最大文字数
+TTS_MAX_INPUT_CHARS = 4096
+
+# セリフの間に入れる無音の長さ（秒）
+GAP_SECONDS = 0.5
+
+
+def is_retryable(error):
+    """リトライすれば成功する可能性があるエラーかどうか"""
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def retry_delay(error, attempt, backoff_base=TTS_BACKOFF_BASE):
+    """次のリトライまでの待ち時間（秒）を決める"""
+    # サーバーが Retry-After を返していればそれに従う
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), TTS_BACKOFF_MAX)
+            except ValueError:
+                pass
+
+    # 指数バックオフ（同時に再送が集中しないように揺らぎを入れる）
+    delay = min(backoff_base * 2 ** attempt, TTS_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def synthesize_segment(client, text, voice, model=TTS_MODEL,
+                       max_retries=TTS_MAX_RETRIES, backoff_base=TTS_BACKOFF_BASE):
+    """1つのセリフを音声化してMP3のバイト列を返す（429/5xxはリトライする）
+
+    リトライはここでのバックオフだけにする（SDKの自動リトライと重なると、
+    レート制限のときにリクエスト数が何倍にも増えるため）。
+    """
+    client = client.with_options(max_retries=0)
+    attempt = 0
+    while True:
+        try:
+            with METRICS.timer("tts_request", model=model, voice=voice) as fields:
+                fields["chars"] = len(text)
+                response = client.audio.speech.create(
+                    model=model,
+                    voice=voice,
+                    input=text,
+                    response_format="mp3"
+                )
+                fields["bytes"] = len(response.content)
+            return response.content
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+            METRICS.increment("tts_retries_total", model=model)
+            time.sleep(retry_delay(e, attempt, backoff_base))
+            attempt += 1
+
+
+def synthesize_cached(client, text, voice, model=TTS_MODEL, max_retries=TTS_MAX_RETRIES,
+                      backoff_base=TTS_BACKOFF_BASE, cache=None):
+    """キャッシュにあればそれを返し、なければ音声化してキャッシュに保存する
+
+    戻り値は (MP3のバイト列, キャッシュから取得したかどうか)。
+    """
+    if cache is None:
+        return synthesize_segment(client, text, voice, model, max_retries, backoff_base), False
+
+    key = segment_key(model, voice, text)
+    content = cache.get(key)
+    if content is not None:
+        return content, True
+
+    content = synthesize_segment(client, text, voice, model, max_retries, backoff_base)
+    cache.put(key, content)
+    return content, False
+
+
+def synthesize_segments(client, segments, max_workers=TTS_MAX_WORKERS, model=TTS_MODEL,
+                        max_retries=TTS_MAX_RETRIES, backoff_base=TTS_BACKOFF_BASE,
+                        on_segment=None, cache=None, stats=None, executor=None):
+    """複数のセリフを並列に音声化する
+
+    segments は {'text': ..., 'voice': ...} のリストまたはイテレータ。
+    イテレータ（ストリーミング中の台本など）の場合は、セリフが届いた時点で
+    音声化を始めるので、台本の生成と音声の生成が並行して進む。
+    戻り値は (音声のリスト, エラーの辞書)。音声のリストは segments と同じ順番で、
+    失敗したセリフは None になり、エラーの辞書に {番号: 例外} で入る。
+    on_segment を渡すと、セリフが1つ終わるたびに呼び出し元のスレッドで
+    (番号, 音声またはNone) で呼び出す。
+    cache（SegmentCache）を渡すと、同じモデル・声・テキストの音声を再利用する。
+    stats に辞書を渡すと、キャッシュのヒット数・ミス数と、キャッシュから
+    取得したセリフの番号（'cached'）を記録する。
+    executor を渡すと、新しいスレッドプールを作らずにそれを使う
+    （その場合 max_workers は使われない）。
+    """
+    if stats is not None:
+        stats.setdefault('hits', 0)
+        stats.setdefault('misses', 0)
+        stats.setdefault('cached', set())
+    results = []
+    errors = {}
+    pending = {}
+
+    def collect(block):
+        # 完了したリクエストの結果を取り出す
+        if not pending:
+            return
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = pending.pop(future)
+            try:
+                results[i], hit = future.result()
+                if stats is not None:
+                    stats['hits' if hit else 'misses'] += 1
+                    if hit:
+                        stats['cached'].add(i)
+            except Exception as e:
+                errors[i] = e
+            if on_segment:
+                on_segment(i, results[i])
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        for i, segment in enumerate(segments):
+            results.append(None)
+            future = executor.submit(
+                synthesize_cached, client, segment['text'], segment['voice'],
+                model, max_retries, backoff_base, cache
+            )
+            pending[future] = i
+            collect(block=False)
+    finally:
+        # セリフの供給元（ストリーミング中の台本など）が途中で失敗しても、
+        # 送信済みのリクエストは課金されるので結果を受け取ってから終える
+        while pending:
+            collect(block=True)
+        if own_executor:
+            executor.shutdown()
+
+    if cache is not None:
+        cache.flush()
+
+    return results, errors
+
+
+def decode_segment(content, sr=None):
+    """MP3のバイト列を一時ファイルを使わずにメモリ上でデコードする"""
+    import librosa
+
+    with METRICS.timer("decode") as fields:
+        fields["bytes"] = len(content)
+        return librosa.load(io.BytesIO(content), sr=sr)
+
+
+def iter_decoded_segments(contents, gap_seconds=GAP_SECONDS):
+    """セリフを1つずつデコード・正規化し、間の無音と合わせて順に返す
+
+    1つ目のセリフのサンプリングレートに揃える。最初に (サンプリングレート) を、
+    その後に音声の配列を返すジェネレーター。
+    """
+    import librosa
+    import numpy as np
+
+    sr = None
+    silence = None
+    for content in contents:
+        audio, current_sr = decode_segment(content, sr)
+        if sr is None:
+            sr = current_sr
+            silence = np.zeros(int(gap_seconds * sr), dtype=np.float32)
+            yield sr
+        else:
+            yield silence
+        yield librosa.util.normalize(audio)
+
+
+def write_episode(contents, output_file, gap_seconds=GAP_SECONDS, normalize_mode="peak"):
+    """セリフの音声（MP3）を順番に結合して output_file に書き出す
+
+    すべてのMP3の形式が揃っていれば、デコードせずにフレームをそのまま連結する
+    （再エンコードによる劣化もない）。揃っていなければセリフごとにデコードして
+    正規化し、ブロック単位で正規化しながらエンコードし直す
+    （normalize_mode は 'peak' または 'loudness'）。
+    フレームの連結ではゲインを変えられないので、'loudness' のときは形式が揃っていても
+    デコードしてラウドネスを揃える（'peak' では同じモデルの音声のレベルは揃っているので
+    そのまま連結する）。
+    戻り値は使った方式（'mp3' または 'decoded'）。音声がなければ None。
+    """
+    contents = [content for content in contents if content is not None]
+    if not contents:
+        return None
+
+    if normalize_mode != "loudness":
+        try:
+            with METRICS.timer("assemble", mode="mp3") as fields:
+                data = concat_mp3(contents, gap_seconds)
+                fields["segments"] = len(contents)
+                with open(output_file, "wb") as f:
+                    f.write(data)
+                fields["bytes"] = len(data)
+            return 'mp3'
+        except MP3FormatError:
+            pass
+
+    # エピソード全体をメモリに載せずに、ブロック単位で書き出す
+    from loudness import write_normalized
+
+    # （デコード・正規化・エンコードが交互に進むので、まとめて計測する）
+    with METRICS.timer("assemble", mode="decoded", normalize=normalize_mode) as fields:
+        decoded = iter_decoded_segments(contents, gap_seconds)
+        sr = next(decoded)
+        write_normalized(decoded, output_file, sr, mode=normalize_mode)
+        fields["segments"] = len(contents)
+        fields["bytes"] = os.path.getsize(output_file)
+    return 'decoded'